@@ -1,188 +1,291 @@
 # app.py
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
-import math, threading, time
+import hashlib, json, math, os, threading, time, uuid
+import urllib.request, urllib.error
+import numpy as np
+from fleet_sim import FleetSimulator
+from broadcast import Broadcaster, format_sse
+from seat_log import SeatEventLog
+from state_file import FleetStateFile
+from network import load_network
+from spatial import GridIndex
+from map_match import RouteSegmentIndex
+from history import PositionHistory
+from speed_profile import SegmentSpeedProfiles
+import codec
 
 # ------------------------------
 # APP SETUP
 # ------------------------------
 app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}})
-
-# ------------------------------
-# BUS DATA (SEATS + STATIC INFO)
-# ------------------------------
-# Note: 'buses' contains seat info and stop names for quick UI display.
-# 'routes' below contains the coordinates for each stop used for simulation.
-buses = {
-    "BusA": {
-        "name": "Bus A",
-        "route": "Katpadi - Bagayam (Route 1)",
-        "total_seats": 42,
-        "available_seats": 32,
-        "stops": [
-            "Vallimalai Koot Road",
-            "Uzhavar Sandhai (Farmer’s Market), Katpadi Govt. HSS",
-            "Katpadi Junction Railway Station",
-            "Chittoor Bus Stand",
-            "Odai Pillaiyar Koil",
-            "Silk Mill",
-            "Kangeyanallur Road",
-            "Viruthampet",
-            "Vellore New Bus Stand",
-            "Green Circle Signal",
-            "National Pachaiyappas",
-            "CMC (Christian Medical College)",
-            "Vellore Old Bus Stand",
-            "Raja Theatre",
-            "Voorhees College",
-            "Kaspa Roundtana",
-            "Lakshmi Theatre",
-            "Toll Gate",
-            "Circuit House",
-            "Allapuram",
-            "Thorapadi",
-            "Mgr selai",
-            "Vellore central Jail",
-            "Vellore female jail",
-            "Thandhai Periyar Polytechnic college",
-            "CMC bagayam Campus",
-            "Bagayam"
-        ]
-    },
-    "BusB": {
-        "name": "Bus B",
-        "route": "Bagayam - Katpadi (Route 2)",
-        "total_seats": 42,
-        "available_seats": 35,
-        "stops": [
-            "Bagayam",
-            "Ooteri",
-            "Virupatchipuram",
-            "Kuppam",
-            "Sainathapuram",
-            "DKM College for Women",
-            "Sankaranpalayam",
-            "Velapadi",
-            "Dhinakaran",
-            "Eye Hospital (CMC Eye Hospital)",
-            "Raja Theatre",
-            "Vellore Old Bus Stand",
-            "CMC (Christian Medical College)",
-            "National Pachaiyappas",
-            "Green Circle Signal",
-            "Vellore New Bus Stand",
-            "Viruthampet",
-            "Kangeyanallur Road",
-            "Silk Mill",
-            "Odai Pillaiyar Koil",
-            "Chittoor Bus Stand",
-            "Katpadi Junction Railway Station",
-            "Uzhavar Sandhai (Farmer’s Market)",
-            "Vallimalai Koot Road"
-        ]
-    }
-}
-
-# ------------------------------
-# ROUTES (stop coordinates) — used for simulation & map display
-# ------------------------------
-routes = {
-    "BusA": [
-        {"name": "Vallimalai Koot Road", "lat": 12.980006851024251, "lon": 79.1367005969659},
-        {"name": "Uzhavar Sandhai / Katpadi Govt School", "lat": 12.973337311617323, "lon": 79.13698498304608},
-        {"name": "Katpadi Junction", "lat": 12.97087989374402, "lon": 79.13712402936956},
-        {"name": "Chittoor Bus Stand", "lat": 12.96585650547078, "lon": 79.1372504488863},
-        {"name": "Odai Pillaiyar Koil", "lat": 12.959242073164399, "lon": 79.13718787209929},
-        {"name": "Silk Mill", "lat": 12.949788381583813, "lon": 79.13702408807158},
-        {"name": "Kangeyanallur Road", "lat": 12.947115101258914, "lon": 79.13697600158129},
-        {"name": "Viruthampet", "lat": 12.945936441884724, "lon": 79.13699589127368},
-        {"name": "Vellore New Bus Stand", "lat": 12.9347076095303, "lon": 79.13560293393449},
-        {"name": "Green Circle Signal", "lat": 12.932601035454612, "lon": 79.13782856201581},
-        {"name": "National Pachaiyappas", "lat": 12.928862771931959, "lon": 79.13385072773515},
-        {"name": "CMC", "lat": 12.924461469097304, "lon": 79.13337902441793},
-        {"name": "Vellore Old Bus Stand", "lat": 12.919946127300875, "lon": 79.13203926240793},
-        {"name": "Raja Theatre", "lat": 12.914935719015206, "lon": 79.13245484200017},
-        {"name": "Voorhees College", "lat": 12.910807899347695, "lon": 79.13195559465684},
-        {"name": "Kaspa Roundtana", "lat": 12.907022494810079, "lon": 79.13192281805382},
-        {"name": "Lakshmi Theatre", "lat": 12.90276691107113, "lon": 79.1317315565256},
-        {"name": "Toll Gate", "lat": 12.899722602109236, "lon": 79.13103503197901},
-        {"name": "Circuit House", "lat": 12.897348413561327, "lon": 79.13021152182107},
-        {"name": "Allapuram", "lat": 12.895012327594811, "lon": 79.12781712618349},
-        {"name": "Thorapadi", "lat": 12.892559716597916, "lon": 79.12489459198655},
-        {"name": "Mgr selai", "lat": 12.890628014762674, "lon": 79.12301258625696},
-        {"name": "Vellore central Jail", "lat": 12.887640301605582, "lon": 79.12236251575973},
-        {"name": "Vellore female jail", "lat": 12.88381379778708, "lon": 79.12315687604197},
-        {"name": "Thandhai Periyar Polytechnic college", "lat": 12.879476381377389, "lon": 79.1231717113319},
-        {"name": "CMC bagayam Campus", "lat": 12.879381141746656, "lon": 79.13385200987729},
-        {"name": "Bagayam", "lat": 12.880244806991884, "lon": 79.13461683692577}
-    ],
-    "BusB": [
-        {"name": "Bagayam", "lat": 12.880244806991884, "lon": 79.13461683692577},
-        {"name": "Ooteri", "lat": 12.884368, "lon": 79.135644},
-        {"name": "Virupatchipuram", "lat": 12.889837, "lon": 79.135796},
-        {"name": "Kuppam", "lat": 12.892572464414675, "lon": 79.13564249023099},
-        {"name": "Sainathapuram", "lat": 12.896897058510103, "lon": 79.13516736093563},
-        {"name": "DKM College", "lat": 12.89958563227319, "lon": 79.1351116796563},
-        {"name": "Sankaranpalayam", "lat": 12.901801595765367, "lon": 79.13532898645113},
-        {"name": "Velapadi", "lat": 12.904786550010515, "lon": 79.13578070557476},
-        {"name": "Dhinakaran", "lat": 12.908855632294944, "lon": 79.13329321092732},
-        {"name": "Eye Hospital", "lat": 12.912449426550614, "lon": 79.13307350392738},
-        {"name": "Raja Theatre", "lat": 12.914935719015206, "lon": 79.13245484200017},
-        {"name": "Vellore Old Bus Stand", "lat": 12.919946127300875, "lon": 79.13203926240793},
-        {"name": "CMC", "lat": 12.924461469097304, "lon": 79.13337902441793},
-        {"name": "National Pachaiyappas", "lat": 12.928862771931959, "lon": 79.13385072773515},
-        {"name": "Green Circle Signal", "lat": 12.932601035454612, "lon": 79.13782856201581},
-        {"name": "Vellore New Bus Stand", "lat": 12.9347076095303, "lon": 79.13560293393449},
-        {"name": "Viruthampet", "lat": 12.945936441884724, "lon": 79.13699589127368},
-        {"name": "Kangeyanallur Road", "lat": 12.947115101258914, "lon": 79.13697600158129},
-        {"name": "Silk Mill", "lat": 12.949788381583813, "lon": 79.13702408807158},
-        {"name": "Odai Pillaiyar Koil", "lat": 12.959242073164399, "lon": 79.13718787209929},
-        {"name": "Chittoor Bus Stand", "lat": 12.96585650547078, "lon": 79.1372504488863},
-        {"name": "Katpadi Junction", "lat": 12.97087989374402, "lon": 79.13712402936956},
-        {"name": "Uzhavar Sandhai", "lat": 12.973337311617323, "lon": 79.13698498304608},
-        {"name": "Vallimalai Koot Road", "lat": 12.980006851024251, "lon": 79.1367005969659}
-    ]
-}
+CORS(app, resources={r"/*": {"origins": "*"}}, expose_headers=["ETag", "X-Version"])
+
+# BUS_SIMULATOR picks who drives the simulation in this process:
+#   "thread"  (default) — a daemon thread started at import (see the end of the simulation section)
+#   "asyncio" — a task on the ASGI event loop (set by asgi.py)
+#   "shared"  — nobody here; this is a stateless HTTP worker following a state-owner process
+#               (see MULTI-PROCESS MODE)
+#   "none"    — nobody; the fleet stays still (benchmarks, scripted tests)
+SIMULATOR_MODE = os.environ.get("BUS_SIMULATOR", "thread")
+
+# ------------------------------
+# BUS DATA (SEATS + STATIC INFO) + ROUTES (stop coordinates)
+# ------------------------------
+# Loaded from BUS_NETWORK (data/network.json by default, or a GTFS directory) — see network.py.
+# 'buses' contains seat info and stop names for quick UI display, 'routes' the stops (id, name,
+# coordinates) of each bus in route order, used for simulation & map display. Both are built from
+# the same canonical stop list, so names always agree.
+NETWORK_PATH = os.environ.get("BUS_NETWORK", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "network.json"))
+network = load_network(NETWORK_PATH)
+stops = network["stops"]
+buses = network["buses"]
+routes = network["routes"]
+
+# ------------------------------
+# STATE CONCURRENCY
+# ------------------------------
+# The simulator thread writes while Flask request threads read, so:
+#  - bus_state[bid] entries are immutable snapshots. Writers build a new dict and swap it in
+#    (one dict assignment is atomic); readers take bus_state[bid] once and use that snapshot,
+#    so they never block the simulator and never mix fields from two ticks.
+#  - Read-modify-write updates (seat counts, snapshot swaps) hold a per-bus lock taken from a
+#    small striped pool, so different buses never contend on one global lock.
+LOCK_STRIPES = 16
+bus_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+def bus_lock(bid):
+    """Lock guarding read-modify-write updates of bus 'bid' (shared with the other buses of its stripe)."""
+    return bus_locks[hash(bid) % LOCK_STRIPES]
+
+def publish_state(bid, version=None, **changes):
+    """
+    Swap in a new bus_state snapshot for 'bid' with the given fields changed and its version
+    bumped (or set to 'version' when the caller mirrors another process's state).
+    """
+    with bus_lock(bid):
+        old = bus_state[bid]
+        new = dict(old, **changes)
+        new["version"] = old["version"] + 1 if version is None else version
+        bus_state[bid] = new
+    return new
+
+# ------------------------------
+# RESPONSE ENCODING (see codec.py)
+# ------------------------------
+# Read endpoints answer in the representation the client negotiated: JSON or MessagePack,
+# br/gzip compression and an optional ?fields= projection. Every representation has its own
+# ETag and the responses carry Vary, so 304s and shared caches keep working. Endpoints that
+# also take ?since=<X-Version> return only what changed after that version; versions carry
+# BOOT_ID, so a token from before a restart gets the full response again.
+def version_token(version):
+    return f"{BOOT_ID}.{version}"
+
+def parse_since(token):
+    """Version number of a ?since= token from this process (None: missing, malformed or from another boot)."""
+    boot, _, version = (token or "").rpartition(".")
+    if boot != BOOT_ID or not version.isdigit():
+        return None
+    return int(version)
+
+def encoded_response(build, etag=None, variants=None, variant=(), max_age=None, headers=None):
+    """
+    Response for the payload returned by build(), in the negotiated format and compression.
+    'variant' (strings) tells apart different payloads served under one 'etag' (projections,
+    deltas); 'variants' (dict) caches the encoded bodies per representation, so it must only be
+    shared by requests getting the same payload.
+    """
+    fmt, enc = codec.negotiate_format(request), codec.negotiate_encoding(request)
+    key = (fmt, enc) + tuple(variant)
+    encoded = variants.get(key) if variants is not None else None
+    if encoded is None:
+        payload = build()
+        body = jsonify(payload).get_data() if fmt == "json" else codec.pack(payload)
+        encoded = codec.compress(body, enc)
+        if variants is not None:
+            variants[key] = encoded
+    body, applied = encoded
+    resp = app.response_class(body, mimetype=codec.MIMETYPES[fmt])
+    if applied != "identity":
+        resp.headers["Content-Encoding"] = applied
+    resp.vary.update(("Accept", "Accept-Encoding"))
+    for name, value in (headers or {}).items():
+        resp.headers[name] = value
+    if max_age is not None:
+        resp.cache_control.public = True
+        resp.cache_control.max_age = max_age
+    if etag is None:
+        return resp
+    resp.set_etag("-".join([etag] + [p for p in (fmt, applied) + tuple(variant) if p not in ("json", "identity", "")]))
+    return resp.make_conditional(request)
 
 # ------------------------------
 # ROUTES (for seats info)
 # ------------------------------
+# Both endpoints take ?fields= (per bus, e.g. fields=available_seats,total_seats); /buses also
+# takes ?since= and then lists only the buses whose seats changed. Stop names and coordinates
+# are served once by /routes (STATIC ROUTE GEOMETRY).
 @app.route('/')
 def home():
     return "✅ Smart Bus Tracker Backend is running!"
 
+buses_variants = {"version": None, "variants": {}}  # encoded full /buses bodies of one seats_version
+
 @app.route('/buses')
 def get_all_buses():
     # Return seat info + stop names (no coords here)
-    return jsonify(buses)
+    global buses_variants
+    fields = codec.parse_fields(request.args.get("fields"))
+    version = seats_version  # read first: a change racing this request is sent again next time
+    since = parse_since(request.args.get("since"))
+    headers = {"X-Version": version_token(version)}
+    if since is not None:
+        changed = [bid for bid, v in seat_versions.items() if v > since]
+        return encoded_response(lambda: {bid: codec.project(buses[bid], fields) for bid in changed},
+                                etag=f"buses-{BOOT_ID}-{version}", variant=(codec.fields_key(fields), f"s{since}"),
+                                headers=headers)
+    cache = buses_variants
+    if cache["version"] != version:
+        cache = buses_variants = {"version": version, "variants": {}}
+    return encoded_response(lambda: {bid: codec.project(bus, fields) for bid, bus in buses.items()},
+                            etag=f"buses-{BOOT_ID}-{version}", variants=cache["variants"],
+                            variant=(codec.fields_key(fields),), headers=headers)
 
 @app.route('/bus/<bus_id>')
 def get_bus(bus_id):
     bus = buses.get(bus_id)
     if not bus:
         return jsonify({"error": "Bus not found"}), 404
-    return jsonify(bus)
+    fields = codec.parse_fields(request.args.get("fields"))
+    return encoded_response(lambda: codec.project(bus, fields), etag=f"bus-{bus_id}-{BOOT_ID}-{seat_versions[bus_id]}",
+                            variant=(codec.fields_key(fields),))
+
+# ------------------------------
+# SEAT UPDATES (event log + single and batched ingestion)
+# ------------------------------
+# Every accepted seat change is appended to the seat event log before it is applied, and
+# replayed at startup (see restore_state). SEAT_EVENT_LOG="" keeps the log in memory only.
+# With a state file, the log is compacted (see seat_log.py) at startup and whenever it grows past
+# SEAT_LOG_COMPACT_BYTES: every bus's seats are checkpointed first, so only the last
+# SEAT_LOG_KEEP_EVENTS events are kept, for retry deduplication.
+seat_log = SeatEventLog(os.environ.get("SEAT_EVENT_LOG", "seat_events.log") or None)
+SEAT_LOG_COMPACT_BYTES = 4 * 1024 * 1024
+SEAT_LOG_KEEP_EVENTS = 50000
+
+# Seat change versions for /buses?since=: seats_version counts seat changes in this process
+# (shared mode: the owner's state file seq at the sync that saw them), seat_versions holds the
+# version of each bus's last change.
+seats_version = 0
+seat_versions = {bid: 0 for bid in buses}
+seats_version_lock = threading.Lock()
+
+def mark_seats_changed(bus_ids, version=None):
+    global seats_version
+    with seats_version_lock:
+        seats_version = seats_version + 1 if version is None else version
+        for bid in bus_ids:
+            seat_versions[bid] = seats_version
+
+def apply_seat_event(bus_id, boarded, alighted):
+    """Apply one boarded/alighted delta to buses[bus_id] (caller holds bus_lock(bus_id)); returns the new available seats."""
+    bus = buses[bus_id]
+    new_available = max(0, min(bus["available_seats"] - boarded + alighted, bus["total_seats"]))
+    bus["available_seats"] = new_available
+    mark_seats_changed((bus_id,))
+    return new_available
 
 @app.route('/update_seats', methods=['POST'])
 def update_seats():
-    data = request.get_json()
+    data = request.get_json(silent=True) or {}
     bus_id = data.get("bus_id")
-    boarded = data.get("boarded", 0)
-    alighted = data.get("alighted", 0)
 
-    if bus_id not in buses:
+    if SIMULATOR_MODE == "shared":
+        return forward_to_owner()
+    if not isinstance(bus_id, str) or bus_id not in buses:
         return jsonify({"error": "Bus not found"}), 404
+    # Validated before anything is logged: a bad event in the log would break every replay
+    try:
+        boarded = int(data.get("boarded", 0))
+        alighted = int(data.get("alighted", 0))
+        ts = float(data.get("timestamp", time.time()))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid boarded/alighted/timestamp"}), 400
 
-    bus = buses[bus_id]
-    total = bus["total_seats"]
-    new_available = max(0, min(bus["available_seats"] - boarded + alighted, total))
-    bus["available_seats"] = new_available
+    # An optional client event_id makes retries idempotent; without one every call is a new event
+    event = {"id": str(data.get("event_id") or uuid.uuid4().hex), "bus": bus_id,
+             "b": boarded, "a": alighted, "ts": ts}
+    total = buses[bus_id]["total_seats"]
+    with bus_lock(bus_id):
+        duplicate = not seat_log.record([event])
+        new_available = buses[bus_id]["available_seats"] if duplicate else apply_seat_event(bus_id, boarded, alighted)
+        checkpoint_seats(bus_id)
+    if not duplicate:
+        broadcaster.publish(bus_id, "seats", {"bus_id": bus_id, "available_seats": new_available})
+        maybe_compact_seat_log()
 
     return jsonify({
         "message": f"Seat count updated for {bus_id}",
         "available_seats": new_available,
-        "total_seats": total
+        "total_seats": total,
+        "duplicate": duplicate
+    }), 200
+
+@app.route('/update_seats/batch', methods=['POST'])
+def update_seats_batch():
+    """
+    Bulk seat ingestion for camera nodes.
+    Body: {"events": [{"event_id": "cam3-000172", "bus_id": "BusA", "boarded": 2, "alighted": 0,
+                       "timestamp": 1718000000.5}, ...]}
+    Events are deduplicated by event_id against everything already logged, applied per bus in
+    timestamp order and appended to the seat event log (one write per bus in the batch).
+    """
+    if SIMULATOR_MODE == "shared":
+        return forward_to_owner()
+    data = request.get_json(silent=True) or {}
+    events = data.get("events")
+    if not isinstance(events, list):
+        return jsonify({"error": "Expected {\"events\": [...]}"}), 400
+
+    per_bus = {}
+    rejected = []
+    for ev in events:
+        event_id = ev.get("event_id") if isinstance(ev, dict) else None
+        if not event_id:
+            rejected.append({"event_id": None, "error": "Missing event_id"})
+            continue
+        if not isinstance(ev.get("bus_id"), str) or ev["bus_id"] not in buses:
+            rejected.append({"event_id": event_id, "error": "Bus not found"})
+            continue
+        try:
+            parsed = {"id": str(event_id), "bus": ev["bus_id"], "b": int(ev.get("boarded", 0)),
+                      "a": int(ev.get("alighted", 0)), "ts": float(ev.get("timestamp", time.time()))}
+        except (TypeError, ValueError):
+            rejected.append({"event_id": event_id, "error": "Invalid boarded/alighted/timestamp"})
+            continue
+        per_bus.setdefault(ev["bus_id"], []).append(parsed)
+
+    applied, duplicates, seats = [], [], {}
+    for bus_id, group in per_bus.items():
+        group.sort(key=lambda e: e["ts"])
+        with bus_lock(bus_id):
+            fresh = seat_log.record(group)
+            for e in fresh:
+                apply_seat_event(bus_id, e["b"], e["a"])
+            checkpoint_seats(bus_id)
+            seats[bus_id] = buses[bus_id]["available_seats"]
+        # By event object, not id: a second copy of an id within the batch is a duplicate too
+        recorded = {id(e) for e in fresh}
+        applied.extend(e["id"] for e in fresh)
+        duplicates.extend(e["id"] for e in group if id(e) not in recorded)
+        if fresh:
+            broadcaster.publish(bus_id, "seats", {"bus_id": bus_id, "available_seats": seats[bus_id]})
+    maybe_compact_seat_log()
+
+    return jsonify({
+        "applied": applied,
+        "duplicates": duplicates,
+        "rejected": rejected,
+        "available_seats": seats
     }), 200
 
 # ======================================================
@@ -198,18 +301,117 @@ def haversine(lat1, lon1, lat2, lon2):
     c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
     return R * c * 1000.0  # meters
 
-# Simulation params
+# Simulation params (SPEED_MS also stands in for segments without learned travel times)
 SPEED_KMH = 30.0
 SPEED_MS = SPEED_KMH * 1000.0 / 3600.0  # ~8.333... m/s
 REACHED_THRESHOLD_M = 150.0  # when bus is within this to a stop, mark reached
 
+# ------------------------------
+# ROUTE GEOMETRY INDEX (static — built once per route)
+# ------------------------------
+def build_route_index(route):
+    """
+    Precompute the static geometry of a looping route.
+    seg_m[i] is the length of the segment stop i -> stop i+1 (the last one closes the loop back to stop 0),
+    cum_m[i] is the distance from stop 0 to stop i along the route, loop_m the length of the full loop.
+    """
+    n = len(route)
+    seg_m = []
+    for i in range(n):
+        j = (i + 1) % n
+        seg_m.append(haversine(route[i]["lat"], route[i]["lon"], route[j]["lat"], route[j]["lon"]))
+    cum_m = [0.0] * n
+    for i in range(1, n):
+        cum_m[i] = cum_m[i - 1] + seg_m[i - 1]
+    return {"seg_m": seg_m, "cum_m": cum_m, "loop_m": sum(seg_m)}
+
+route_index = {bid: build_route_index(r) for bid, r in routes.items()}
+
+# Inverted index: canonical stop id -> [(bus_id, index of the stop on that bus's route)]
+stop_routes = {}
+for bid, r in routes.items():
+    for idx, stop in enumerate(r):
+        stop_routes.setdefault(stop["id"], []).append((bid, idx))
+
+def distance_between_stops(bid, from_idx, to_idx):
+    """Distance in meters walking forward along the route from stop from_idx to stop to_idx (0 when equal)."""
+    index = route_index[bid]
+    d = index["cum_m"][to_idx] - index["cum_m"][from_idx]
+    if d < 0:
+        d += index["loop_m"]
+    return d
+
+# ------------------------------
+# LEARNED TRAVEL TIMES (ETAs, see speed_profile.py)
+# ------------------------------
+# ETAs come from per-segment, per-time-of-day travel times learned from GPS traversals (stop
+# passed -> next stop passed). Simulated movement is never learned, so a fleet without GPS keeps
+# the constant SPEED_MS ETAs. The averages are saved to BUS_SPEED_PROFILES every
+# PROFILE_SAVE_SEC by the state owner and reloaded on startup ("" keeps them in memory only);
+# shared-mode workers reload the owner's file whenever it changes.
+PROFILE_PATH = os.environ.get("BUS_SPEED_PROFILES", "speed_profiles.npz")
+PROFILE_BUCKET_SEC = int(os.environ.get("BUS_PROFILE_BUCKET_SEC", "1800"))  # time-of-day slice
+PROFILE_SAVE_SEC = 60.0
+speed_profiles = SegmentSpeedProfiles(routes, {bid: index["seg_m"] for bid, index in route_index.items()},
+                                      SPEED_MS, bucket_sec=PROFILE_BUCKET_SEC)
+
+def seconds_between_stops(bid, from_idx, to_idx, table):
+    """Learned seconds riding forward from stop from_idx to stop to_idx (0 when equal), from a speed_profiles table."""
+    off = speed_profiles.offset[bid]
+    cum_s = table["cum_s"]
+    t = cum_s[off + to_idx] - cum_s[off + from_idx]
+    if t < 0:
+        t += table["loop_s"][fleet.index[bid]]
+    return t
+
+def seconds_to_next_stop(bid, last_idx, to_next_m, table):
+    """Learned seconds for the to_next_m meters left on the segment after stop last_idx."""
+    seg_m = route_index[bid]["seg_m"][last_idx]
+    if seg_m <= 0:
+        return 0.0
+    return table["seg_s"][speed_profiles.offset[bid] + last_idx] * to_next_m / seg_m
+
+def load_speed_profiles():
+    """Load PROFILE_PATH if it exists; returns its mtime (None when there is nothing to load)."""
+    try:
+        mtime = os.stat(PROFILE_PATH).st_mtime
+        speed_profiles.load(PROFILE_PATH)
+        return mtime
+    except (OSError, KeyError, ValueError):
+        return None
+
+def save_profiles_loop():
+    saved = None
+    while True:
+        time.sleep(PROFILE_SAVE_SEC)
+        if speed_profiles.count_all.sum() != saved:
+            saved = speed_profiles.count_all.sum()
+            speed_profiles.save(PROFILE_PATH)
+
+def follow_profiles_loop(mtime):
+    """Shared-mode worker: reload the owner's profiles whenever the file is replaced."""
+    while True:
+        time.sleep(PROFILE_SAVE_SEC / 4)
+        try:
+            current = os.stat(PROFILE_PATH).st_mtime
+        except OSError:
+            continue
+        if current != mtime:
+            mtime = load_speed_profiles()
+
+# Live update fan-out for /stream subscribers (fed by simulate_tick and update_seats)
+broadcaster = Broadcaster(history=max(4096, 4 * len(routes)))
+STREAM_KEEPALIVE_SEC = 15.0
+
 # Simulation state: store last passed stop index and current lat/lon
+# (each entry is an immutable snapshot replaced through publish_state — see STATE CONCURRENCY)
 bus_state = {}
 for bid, r in routes.items():
     bus_state[bid] = {
         "last_idx": 0,       # index of last stop passed (bus starts at stop 0)
         "lat": r[0]["lat"],
-        "lon": r[0]["lon"]
+        "lon": r[0]["lon"],
+        "version": 0         # bumped on every position change (drives the live_status cache)
     }
 
 def advance_bus_one_tick(bid, dt=1.0):
@@ -229,8 +431,7 @@ def advance_bus_one_tick(bid, dt=1.0):
     dist_to_next = haversine(lat_cur, lon_cur, lat_next, lon_next)
     if dist_to_next < 0.5:
         # Snap to next and advance index
-        state["lat"], state["lon"] = lat_next, lon_next
-        state["last_idx"] = next_idx
+        publish_state(bid, lat=lat_next, lon=lon_next, last_idx=next_idx)
         return
 
     # Move along segment proportionally
@@ -238,65 +439,534 @@ def advance_bus_one_tick(bid, dt=1.0):
     frac = min(1.0, move_m / dist_to_next)
     new_lat = lat_cur + (lat_next - lat_cur) * frac
     new_lon = lon_cur + (lon_next - lon_cur) * frac
-    state["lat"], state["lon"] = new_lat, new_lon
 
     # If now within threshold of the next stop, snap and mark passed
     if haversine(new_lat, new_lon, lat_next, lon_next) <= REACHED_THRESHOLD_M:
-        state["lat"], state["lon"] = lat_next, lon_next
-        state["last_idx"] = next_idx
+        publish_state(bid, lat=lat_next, lon=lon_next, last_idx=next_idx)
+    else:
+        publish_state(bid, lat=new_lat, lon=new_lon)
+
+# Vectorized engine holding the whole fleet in NumPy arrays (advance_bus_one_tick is the
+# per-bus reference implementation of the same movement rules).
+fleet = FleetSimulator(routes, SPEED_MS, REACHED_THRESHOLD_M)
+fleet.load_state(bus_state)
+
+# Spatial indexes for the nearby endpoints: stops are static, buses (item i = fleet.bus_ids[i])
+# are re-filed incrementally whenever the fleet positions change.
+stop_ids = list(stops.keys())
+stop_index = GridIndex([stops[sid]["lat"] for sid in stop_ids], [stops[sid]["lon"] for sid in stop_ids])
+bus_index = GridIndex(fleet.lat, fleet.lon, cell_m=500.0)
+
+# ------------------------------
+# PERSISTENCE (memory-mapped fleet state + warm restart)
+# ------------------------------
+# Positions are checkpointed into BUS_STATE_FILE on every tick (a few array copies into mapped
+# memory) and seat counts whenever they change, together with the seat log size they reflect.
+# On startup the file is restored and only the seat events logged after each bus's checkpoint
+# are replayed. BUS_STATE_FILE="" disables it (buses restart at stop 0, seats from the full log).
+# In "shared" mode the file belongs to the owner process and is only mapped read-only here.
+STATE_FILE_PATH = os.environ.get("BUS_STATE_FILE", "fleet_state.bin")
+state_file = None
+if STATE_FILE_PATH and SIMULATOR_MODE != "shared":
+    state_file = FleetStateFile(STATE_FILE_PATH, fleet.bus_ids)
+sim_tick = 0
+
+def checkpoint_seats(bus_id):
+    """Persist buses[bus_id] seats with the seat log size they reflect (caller holds bus_lock(bus_id))."""
+    if state_file is not None and SIMULATOR_MODE != "shared":
+        state_file.write_seats(bus_id, buses[bus_id]["available_seats"], seat_log.size)
+
+def maybe_compact_seat_log(force=False):
+    """Compact the seat log once it is big enough (needs the state file: checkpoints replace the dropped events)."""
+    if state_file is None or SIMULATOR_MODE == "shared" or not (force or seat_log.file_bytes > SEAT_LOG_COMPACT_BYTES):
+        return
+    for lock in bus_locks:  # no seat event between the checkpoints and the rewrite
+        lock.acquire()
+    try:
+        if force or seat_log.file_bytes > SEAT_LOG_COMPACT_BYTES:
+            for bid in buses:
+                checkpoint_seats(bid)
+            seat_log.compact(SEAT_LOG_KEEP_EVENTS)
+    finally:
+        for lock in bus_locks:
+            lock.release()
+
+def checkpoint_positions():
+    """Persist every bus position for the current sim_tick."""
+    if state_file is not None and SIMULATOR_MODE != "shared":
+        state_file.write_positions(fleet.lat, fleet.lon, fleet.last_idx, sim_tick)
+
+def restore_state():
+    """Warm restart: positions and seats from the state file, then the seat events logged after each bus's checkpoint."""
+    global sim_tick
+    seat_log_offsets = {}
+    if state_file is not None:
+        sim_tick = state_file.saved_tick
+        for bid, rec in state_file.saved.items():
+            if bid not in routes or not 0 <= rec["last_idx"] < len(routes[bid]) or (rec["lat"] == 0 and rec["lon"] == 0):
+                continue
+            lat, lon, last_idx = float(rec["lat"]), float(rec["lon"]), int(rec["last_idx"])
+            publish_state(bid, lat=lat, lon=lon, last_idx=last_idx)
+            fleet.set_position(bid, lat, lon, last_idx)
+            buses[bid]["available_seats"] = int(rec["available_seats"])
+            seat_log_offsets[bid] = int(rec["seat_log_offset"])
+    for end, ev in seat_log.replay():
+        if ev["bus"] in buses and end > seat_log_offsets.get(ev["bus"], 0):
+            apply_seat_event(ev["bus"], ev["b"], ev["a"])
+    for bid in buses:
+        checkpoint_seats(bid)
+    maybe_compact_seat_log(force=True)
+    checkpoint_positions()
+    bus_index.update(fleet.lat, fleet.lon)
+
+def simulate_tick(dt=1.0):
+    """
+    Advance every bus by dt seconds in one batched step, publish the positions into bus_state,
+    checkpoint them and push one compact delta per bus to the stream subscribers
+    (last_idx only when a stop was passed). Buses with a recent GPS fix are left to ingest_gps.
+    """
+    global sim_tick
+    deltas = []
+    with fleet_lock:
+        hold = gps_hold_mask()
+        passed = fleet.step(dt, hold).tolist()
+        sim_tick += 1
+        checkpoint_positions()
+        bus_index.update(fleet.lat, fleet.lon)
+        record_history(np.nonzero(~hold)[0], time.time())
+        speed_profiles.forget(np.nonzero(~hold)[0])
+        for (bid, lat, lon, last_idx), passed_stop, held in zip(fleet.iter_states(), passed, hold.tolist()):
+            if held:
+                continue
+            publish_state(bid, lat=lat, lon=lon, last_idx=last_idx)
+            delta = {"bus_id": bid, "lat": lat, "lon": lon}
+            if passed_stop:
+                delta["last_idx"] = last_idx
+            deltas.append((bid, "position", delta))
+    broadcaster.publish_many(deltas)
 
 def simulate_loop(dt=1.0):
     """Background loop moving all buses every dt seconds."""
     while True:
-        for bid in routes.keys():
-            advance_bus_one_tick(bid, dt)
+        simulate_tick(dt)
         time.sleep(dt)
 
-# Start simulation thread
-threading.Thread(target=simulate_loop, args=(1.0,), daemon=True).start()
+# ------------------------------
+# GPS INGESTION (map-matched onto the routes)
+# ------------------------------
+# Real positions from on-board GPS units. Each fix is snapped onto its bus's route through
+# segment_index (only the route's segments in the grid cells around the fix are looked at),
+# preferring segments just ahead of the bus so roads driven in both directions don't flip it.
+# A bus with a fix in the last GPS_STALE_SEC seconds is held still by the simulator, which keeps
+# moving only the buses without GPS (fallback). Every batch that moved a bus counts as a tick:
+# sim_tick numbers position updates, so caches, ETags, the state file and shared-mode workers
+# pick GPS positions up exactly like simulated ones.
+GPS_STALE_SEC = 30.0    # a bus without a fix for this long goes back to the simulator
+GPS_MAX_SNAP_M = 300.0  # fixes farther than this from every segment of the route are rejected
+# Fixes timestamped outside [server time - GPS_MAX_AGE_SEC, server time + GPS_MAX_AHEAD_SEC] are
+# rejected: one far-future timestamp (e.g. milliseconds sent as seconds) would otherwise make every
+# later fix of the bus look stale, and the history stores timestamps as uint32 seconds.
+GPS_MAX_AGE_SEC = 86400.0
+GPS_MAX_AHEAD_SEC = 300.0
+segment_index = RouteSegmentIndex(routes, cell_m=GPS_MAX_SNAP_M)
+gps_seen = np.full(len(fleet.bus_ids), -np.inf)  # server time of each bus's last accepted fix (fleet order)
+gps_fix_ts = {}                 # bus_id -> device timestamp of the last accepted fix
+fleet_lock = threading.Lock()   # serializes fleet array updates between simulate_tick and ingest_gps
+
+def gps_hold_mask():
+    """Boolean mask (fleet order) of the buses currently positioned by GPS."""
+    return (time.time() - gps_seen) < GPS_STALE_SEC
+
+def ingest_gps(pings):
+    """
+    Apply a batch of fixes [{"bus_id", "lat", "lon", "timestamp"}]: per bus in timestamp order, each
+    fix newer than the bus's last one is snapped onto the route (last_idx = the segment's start stop)
+    and the latest snapped position is published. Returns {"accepted", "stale", "rejected", "tick"}.
+    """
+    global sim_tick
+    rejected, per_bus = [], {}
+    received = time.time()
+    for p in pings:
+        bid = p.get("bus_id") if isinstance(p, dict) else None
+        if not isinstance(bid, str):
+            rejected.append({"bus_id": None, "error": "Bus not found"})
+            continue
+        if bid not in routes:
+            rejected.append({"bus_id": bid, "error": "Bus not found"})
+            continue
+        try:
+            fix = (float(p.get("timestamp", received)), float(p["lat"]), float(p["lon"]))
+            if not all(map(math.isfinite, fix)):
+                raise ValueError("non-finite fix")
+        except (KeyError, TypeError, ValueError):
+            rejected.append({"bus_id": bid, "error": "Invalid lat/lon/timestamp"})
+            continue
+        if not received - GPS_MAX_AGE_SEC <= fix[0] <= received + GPS_MAX_AHEAD_SEC:
+            rejected.append({"bus_id": bid, "timestamp": fix[0], "error": "Timestamp too far from server time"})
+            continue
+        per_bus.setdefault(bid, []).append(fix)
+
+    accepted = stale = 0
+    deltas = []
+    fixes_rows, fixes_ts, fixes_lat, fixes_lon, fixes_idx = [], [], [], [], []  # every accepted fix, in order
+    with fleet_lock:
+        for bid, fixes in per_bus.items():
+            fixes.sort()
+            i = fleet.index[bid]
+            last_idx = int(fleet.last_idx[i])
+            position = None
+            for ts, lat, lon in fixes:
+                if ts <= gps_fix_ts.get(bid, -math.inf):
+                    stale += 1
+                    continue
+                match = segment_index.snap(bid, lat, lon, GPS_MAX_SNAP_M, prev_idx=last_idx)
+                if match is None:
+                    rejected.append({"bus_id": bid, "timestamp": ts, "error": "Too far from the route"})
+                    continue
+                last_idx, _, snap_lat, snap_lon, _ = match
+                position = (snap_lat, snap_lon, last_idx, ts)
+                gps_fix_ts[bid] = ts
+                accepted += 1
+                fixes_rows.append(i)
+                fixes_ts.append(ts)
+                fixes_lat.append(snap_lat)
+                fixes_lon.append(snap_lon)
+                fixes_idx.append(last_idx)
+            if position is None:
+                continue
+            gps_seen[i] = received
+            lat, lon, last_idx, ts = position
+            fleet.set_position(bid, lat, lon, last_idx)
+            old_idx = bus_state[bid]["last_idx"]
+            publish_state(bid, lat=lat, lon=lon, last_idx=last_idx)
+            delta = {"bus_id": bid, "lat": lat, "lon": lon}
+            if last_idx != old_idx:
+                delta["last_idx"] = last_idx
+            deltas.append((bid, "position", delta))
+        if deltas:
+            sim_tick += 1
+            checkpoint_positions()
+            bus_index.update(fleet.lat, fleet.lon)
+            fixes_rows = np.array(fixes_rows, dtype=np.int64)
+            record_history(fixes_rows, fixes_ts, fixes_lat, fixes_lon, fixes_idx)
+            speed_profiles.record_passes(fixes_rows, fixes_idx, fixes_ts)
+    if deltas:
+        broadcaster.publish_many(deltas)
+    return {"accepted": accepted, "stale": stale, "rejected": rejected, "tick": sim_tick}
+
+@app.route('/gps/batch', methods=['POST'])
+def gps_batch():
+    """
+    GPS ingestion for on-board units (typically one 1 Hz fix per bus, batched by a gateway).
+    Body: {"pings": [{"bus_id": "BusA", "lat": 12.9712, "lon": 79.1371, "timestamp": 1718000000.0}, ...]}
+    """
+    if SIMULATOR_MODE == "shared":
+        return forward_to_owner()
+    data = request.get_json(silent=True) or {}
+    pings = data.get("pings")
+    if not isinstance(pings, list):
+        return jsonify({"error": "Expected {\"pings\": [...]}"}), 400
+    return jsonify(ingest_gps(pings)), 200
+
+# ------------------------------
+# POSITION HISTORY (per-bus ring buffers, see history.py)
+# ------------------------------
+# Every simulated tick appends one point per moved bus, every accepted GPS fix one point. Capacity is fixed
+# up front (BUS_HISTORY_CAPACITY points per bus, 16 bytes each); with BUS_HISTORY_DIR set,
+# points are also spilled to columnar .npz files before they are overwritten.
+# Shared-mode workers keep no history and forward /history to the owner.
+HISTORY_CAPACITY = int(os.environ.get("BUS_HISTORY_CAPACITY", "3600"))  # 1 h at 1 Hz
+HISTORY_DIR = os.environ.get("BUS_HISTORY_DIR", "")
+MAX_HISTORY_POINTS = 10000
+history = PositionHistory(fleet.bus_ids, HISTORY_CAPACITY if SIMULATOR_MODE != "shared" else 0,
+                          spill_dir=HISTORY_DIR or None)
+
+def record_history(rows, ts, lat=None, lon=None, last_idx=None):
+    """
+    Append points for the given fleet rows (caller holds fleet_lock): lat/lon/last_idx, or the
+    rows' current fleet position when they are not given. Rows may repeat (several GPS fixes).
+    """
+    if history.capacity:
+        seats = [buses[fleet.bus_ids[i]]["available_seats"] for i in rows.tolist()]
+        if lat is None:
+            lat, lon, last_idx = fleet.lat[rows], fleet.lon[rows], fleet.last_idx[rows]
+        history.append(rows, ts, lat, lon, last_idx, seats)
+
+def spill_history_loop():
+    while True:
+        time.sleep(1.0)
+        history.maybe_spill()
+
+if history.spill_dir and history.capacity:
+    threading.Thread(target=spill_history_loop, daemon=True).start()
+
+@app.route("/history/<bus_id>", methods=["GET"])
+def bus_history(bus_id):
+    """
+    Recorded positions of bus_id, oldest first, as columns (ts, lat, lon, last_idx, available_seats).
+    ?start=&end= (unix seconds) select a range, ?step= keeps one point per step seconds and
+    ?limit= (default 1000, at most MAX_HISTORY_POINTS) thins the result evenly.
+    """
+    if SIMULATOR_MODE == "shared":
+        return forward_to_owner()
+    if bus_id not in routes:
+        return jsonify({"error": "Bus not found"}), 404
+    args = request.args
+    limit = max(1, min(args.get("limit", 1000, type=int), MAX_HISTORY_POINTS))
+    step = args.get("step", type=float)
+    if step is not None and not 0.0 < step < math.inf:
+        return jsonify({"error": "step must be a positive number of seconds"}), 400
+    points = history.query(bus_id, args.get("start", type=float), args.get("end", type=float), step, limit)
+    return jsonify({"bus_id": bus_id, "count": len(points["ts"]), "capacity": history.capacity, "points": points})
+
+# ------------------------------
+# MULTI-PROCESS MODE (BUS_SIMULATOR=shared)
+# ------------------------------
+# One state-owner process (`python app.py`, or any non-shared mode) runs the simulator, owns the
+# seat event log and writes BUS_STATE_FILE. Any number of stateless HTTP workers map that file
+# read-only, follow its ticks and forward seat writes to the owner, e.g.
+#   python app.py                                                   # owner on :5000
+#   BUS_SIMULATOR=shared BUS_OWNER_URL=http://127.0.0.1:5000 gunicorn -w 8 -b 0.0.0.0:8000 app:app
+# Every worker serves the owner's tick (ETags use the tick as version), so responses agree across workers.
+OWNER_URL = os.environ.get("BUS_OWNER_URL", "http://127.0.0.1:5000")
+SHARED_POLL_SEC = 0.05
+sync_lock = threading.Lock()
+synced_seq = -1
+
+def open_shared_state_file(timeout=30.0):
+    """Map the owner's state file read-only, waiting for the owner to create it."""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return FleetStateFile.open_reader(STATE_FILE_PATH)
+        except FileNotFoundError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.2)
+
+def sync_from_state_file():
+    """Mirror the owner's latest snapshot into bus_state / buses / fleet and notify stream subscribers."""
+    global sim_tick, synced_seq
+    if state_file.seq == synced_seq:
+        return  # lock-free fast path: nothing new from the owner
+    with sync_lock:
+        seq = state_file.seq
+        if seq == synced_seq:
+            return
+        tick, records = state_file.snapshot()
+        deltas, seat_changes = [], []
+        for bid, rec in zip(state_file.bus_ids, records.tolist()):
+            if bid not in bus_state:
+                continue
+            lat, lon, last_idx, seats, _ = rec
+            old = bus_state[bid]
+            if tick != sim_tick or last_idx != old["last_idx"]:
+                publish_state(bid, version=tick, lat=lat, lon=lon, last_idx=last_idx)
+                fleet.set_position(bid, lat, lon, last_idx)
+                delta = {"bus_id": bid, "lat": lat, "lon": lon}
+                if last_idx != old["last_idx"]:
+                    delta["last_idx"] = last_idx
+                deltas.append((bid, "position", delta))
+            if seats != buses[bid]["available_seats"]:
+                buses[bid]["available_seats"] = seats
+                seat_changes.append(bid)
+                deltas.append((bid, "seats", {"bus_id": bid, "available_seats": seats}))
+        if seat_changes:
+            mark_seats_changed(seat_changes, version=seq)
+        bus_index.update(fleet.lat, fleet.lon)
+        sim_tick, synced_seq = tick, seq
+    if deltas:
+        broadcaster.publish_many(deltas)
+
+def follow_state_file():
+    """Worker-side loop: pick up every owner write within SHARED_POLL_SEC."""
+    while True:
+        sync_from_state_file()
+        time.sleep(SHARED_POLL_SEC)
+
+def forward_to_owner():
+    """Relay the current request (seat or GPS writes, history reads) to the owner process and return its response unchanged."""
+    req = urllib.request.Request(OWNER_URL + request.full_path.rstrip("?"), data=request.get_data() or None,
+                                 headers={"Content-Type": "application/json"}, method=request.method)
+    try:
+        with urllib.request.urlopen(req, timeout=5) as resp:
+            status, body = resp.status, resp.read()
+    except urllib.error.HTTPError as e:
+        status, body = e.code, e.read()
+    except urllib.error.URLError:
+        return jsonify({"error": "State owner unavailable"}), 503
+    sync_from_state_file()  # read-your-writes: the owner has already checkpointed the new seats
+    return app.response_class(body, status=status, mimetype="application/json")
+
+# Start the simulation (thread mode) or follow the owner (shared mode)
+if SIMULATOR_MODE == "shared":
+    state_file = open_shared_state_file()
+    sync_from_state_file()
+    threading.Thread(target=follow_state_file, daemon=True).start()
+    # Requests also sync (a single counter read when nothing changed) so a seat write made
+    # through one worker is visible from every other worker right away.
+    app.before_request(sync_from_state_file)
+    if PROFILE_PATH:
+        threading.Thread(target=follow_profiles_loop, args=(load_speed_profiles(),), daemon=True).start()
+else:
+    restore_state()
+    if PROFILE_PATH:
+        load_speed_profiles()
+        threading.Thread(target=save_profiles_loop, daemon=True).start()
+if SIMULATOR_MODE == "thread":
+    threading.Thread(target=simulate_loop, args=(1.0,), daemon=True).start()
 
 def remaining_distance_along_route(bid, target_idx):
     """
     Compute remaining distance in meters along the route from the bus's current position to the target stop index.
-    Accumulates segment distances forward along route order.
+    One haversine to the next stop, then the precomputed route_index prefix sums for the rest of the way.
     """
     route = routes[bid]
     state = bus_state[bid]
     n = len(route)
     cur_lat, cur_lon = state["lat"], state["lon"]
-    last_idx = state["last_idx"]
-
-    # If target is the same as last_idx and the bus is exactly at that stop, distance = 0
-    # We'll start by computing distance from current position to the next stop after last_idx (segment start)
-    # Then walk segments until reaching target_idx.
-    # Step 1: distance from current pos to next stop index after last_idx
-    next_idx = (last_idx + 1) % n
-    dist = 0.0
 
     # If the route only has 1 stop (unlikely), just compute direct dist
     if n == 1:
         return haversine(cur_lat, cur_lon, route[0]["lat"], route[0]["lon"])
 
-    # distance from current position to next_idx stop
-    dist += haversine(cur_lat, cur_lon, route[next_idx]["lat"], route[next_idx]["lon"])
-    if next_idx == target_idx:
-        return dist
+    next_idx = (state["last_idx"] + 1) % n
+    dist = haversine(cur_lat, cur_lon, route[next_idx]["lat"], route[next_idx]["lon"])
+    return dist + distance_between_stops(bid, next_idx, target_idx)
 
-    # accumulate full segments from next_idx -> ... -> target_idx
-    i = next_idx
-    while True:
-        j = (i + 1) % n
-        dist += haversine(route[i]["lat"], route[i]["lon"], route[j]["lat"], route[j]["lon"])
-        if j == target_idx:
-            break
-        i = j
+# ------------------------------
+# LIVE STATUS RESPONSE CACHE
+# ------------------------------
+# The serialized body only changes when the simulator moves the bus, so it is built
+# at most once per bus state version and served as-is (with an ETag) to every poller.
+BOOT_ID = uuid.uuid4().hex[:8]  # keeps ETags from a previous process from matching after a restart
+if SIMULATOR_MODE == "shared":
+    BOOT_ID = f"{os.stat(STATE_FILE_PATH).st_ino:x}"  # same for every worker following this owner
+# Besides the encoded bodies, an entry keeps each stop's (distance_m, eta_sec, reached) for this
+# version and the LIVE_STATUS_DIFF_VERSIONS before it ("recent", newest first), so a client polling
+# ?since=<one of those versions> gets only the stops that changed, even if it missed a few ticks.
+# Each kept version is a float64 array of 24 bytes per stop.
+LIVE_STATUS_DIFF_VERSIONS = 8
+live_status_cache = {}  # bus_id -> {"version", "etag", "state", "status", "variants", "dynamic", "recent"}
 
-    return dist
+ETA_DYNAMIC_FIELDS = ("distance_m", "eta_sec", "reached")
+
+def eta_dynamics(status):
+    """(stops x ETA_DYNAMIC_FIELDS) float array of a live status."""
+    return np.array([[e[k] for k in ETA_DYNAMIC_FIELDS] for e in status["etas"]], dtype=np.float64)
+
+def changed_etas(old, new, fields):
+    """Indices of the etas entries whose projected dynamic fields differ between two eta_dynamics arrays."""
+    if fields is not None and "etas" not in fields:
+        return set()
+    wanted = (fields or {}).get("etas") or dict.fromkeys(ETA_DYNAMIC_FIELDS)
+    cols = [i for i, k in enumerate(ETA_DYNAMIC_FIELDS) if k in wanted]
+    return set(np.nonzero((old[:, cols] != new[:, cols]).any(axis=1))[0].tolist())
 
 @app.route("/live_status/<bus_id>", methods=["GET"])
 def live_status(bus_id):
     """
-    Returns current bus lat/lon plus ETA/distance/reached info for every stop (with stop coords).
+    Returns the cached live status for bus_id (see build_live_status), rebuilt only when the bus
+    state version changed. Clients sending a matching If-None-Match get a 304.
+    ?fields= projects it (e.g. fields=lat,lon,last_idx,etas.index,etas.eta_sec — stop names and
+    coordinates come from /route/<bus_id>). ?since=<X-Version> keeps only the etas entries that
+    changed since that version: exact for the last LIVE_STATUS_DIFF_VERSIONS versions, every
+    entry for older ones.
+    """
+    if bus_id not in routes:
+        return jsonify({"error": "Bus not found"}), 404
+
+    state = bus_state[bus_id]  # one consistent snapshot for version + body
+    version = state["version"]
+    cached = live_status_cache.get(bus_id)
+    if cached is None or cached["version"] != version:
+        status = build_live_status(bus_id, state)
+        cached = {
+            "version": version,
+            "etag": f"{bus_id}-{BOOT_ID}-{version}",
+            "state": state,
+            "status": status,  # handed to the first encoding, rebuilt from "state" for the others
+            "variants": {},
+            "dynamic": eta_dynamics(status),
+            "recent": (((cached["version"], cached["dynamic"]),) + cached["recent"])[:LIVE_STATUS_DIFF_VERSIONS]
+                      if cached is not None else ()
+        }
+        live_status_cache[bus_id] = cached
+
+    def status():
+        built = cached.pop("status", None)
+        return built if built is not None else build_live_status(bus_id, cached["state"])
+
+    fields = codec.parse_fields(request.args.get("fields"))
+    since = parse_since(request.args.get("since"))
+    variant = (codec.fields_key(fields),)
+    if since is not None:
+        old = next((dynamic for v, dynamic in cached["recent"] if v == since), None)
+        if since == version:
+            changed = set()
+        elif old is not None:
+            changed = changed_etas(old, cached["dynamic"], fields)
+        else:
+            changed = None  # too old to diff: everything
+
+        def build():
+            delta = dict(status())
+            if changed is not None:
+                delta["etas"] = [e for i, e in enumerate(delta["etas"]) if i in changed]
+            return codec.project(delta, fields)
+        variant += (f"s{since}" if changed is not None else "",)
+    else:
+        build = lambda: codec.project(status(), fields)
+    return encoded_response(build, etag=cached["etag"], variants=cached["variants"], variant=variant,
+                            headers={"X-Version": version_token(version)})
+
+@app.route("/stream", methods=["GET"])
+@app.route("/stream/<bus_id>", methods=["GET"])
+def stream(bus_id=None):
+    """
+    Server-Sent Events push channel. Starts with a full "snapshot" event per bus, then streams
+    compact deltas as they happen:
+      event: position  data: {"bus_id":..,"lat":..,"lon":..[,"last_idx":..]}   (every simulator tick)
+      event: seats     data: {"bus_id":..,"available_seats":..}                 (on /update_seats)
+    /stream sends every bus; /stream/<bus_id> or /stream?bus_id=A&bus_id=B restricts the topics.
+    """
+    wanted = [bus_id] if bus_id else (request.args.getlist("bus_id") or list(routes.keys()))
+    unknown = [bid for bid in wanted if bid not in routes]
+    if unknown:
+        return jsonify({"error": "Bus not found", "bus_ids": unknown}), 404
+    topics = set(wanted)
+
+    def events():
+        cursor = broadcaster.seq
+        yield stream_snapshot(wanted, cursor)
+        while True:
+            frames, cursor = broadcaster.frames_since(cursor, topics)
+            if frames:
+                yield "".join(frames)
+            elif not broadcaster.wait(cursor, STREAM_KEEPALIVE_SEC):
+                yield ": keep-alive\n\n"
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def stream_snapshot(bus_ids, cursor):
+    """Initial "snapshot" SSE frames (position + seats) for the given buses, tagged with the broadcaster cursor."""
+    frames = []
+    for bid in bus_ids:
+        state = bus_state[bid]
+        frames.append(format_sse("snapshot", {
+            "bus_id": bid,
+            "lat": state["lat"],
+            "lon": state["lon"],
+            "last_idx": state["last_idx"],
+            "available_seats": buses[bid]["available_seats"],
+            "total_seats": buses[bid]["total_seats"]
+        }, cursor))
+    return "".join(frames)
+
+def build_live_status(bus_id, state):
+    """
+    Returns the bus lat/lon of the given bus_state snapshot plus ETA/distance/reached info for every stop (with stop coords).
     Response shape:
     {
       "bus_id": "BusA",
@@ -310,11 +980,7 @@ def live_status(bus_id):
       ]
     }
     """
-    if bus_id not in routes:
-        return jsonify({"error": "Bus not found"}), 404
-
     route = routes[bus_id]
-    state = bus_state[bus_id]
     cur_lat = state["lat"]
     cur_lon = state["lon"]
     last_idx = state["last_idx"]
@@ -329,12 +995,19 @@ def live_status(bus_id):
             break
         i = (i + 1) % n
 
+    # Distance and time from the current position to the next stop are shared by every ETA;
+    # the rest of the way comes from the precomputed (distance) and learned (time) prefix sums.
+    next_idx = (last_idx + 1) % n
+    to_next_m = haversine(cur_lat, cur_lon, route[next_idx]["lat"], route[next_idx]["lon"])
+    table = speed_profiles.table()
+    to_next_s = seconds_to_next_stop(bus_id, last_idx, to_next_m, table)
+
     etas = []
     for idx, stop in enumerate(route):
         # remaining distance along the route from current pos to this stop:
-        rem_d = remaining_distance_along_route(bus_id, idx)
+        rem_d = to_next_m + distance_between_stops(bus_id, next_idx, idx)
         # ETA seconds
-        eta_sec = int(rem_d / SPEED_MS) if SPEED_MS > 0 else None
+        eta_sec = to_next_s + seconds_between_stops(bus_id, next_idx, idx, table)
 
         # direct distance to stop (for rough proximity)
         direct_d = haversine(cur_lat, cur_lon, stop["lat"], stop["lon"])
@@ -352,20 +1025,183 @@ def live_status(bus_id):
             "lat": stop["lat"],
             "lon": stop["lon"],
             "distance_m": int(rem_d),
-            "eta_sec": int(eta_sec) if eta_sec is not None else None,
+            "eta_sec": int(eta_sec),
             "reached": bool(reached)
         })
 
-    return jsonify({
+    return {
         "bus_id": bus_id,
         "lat": cur_lat,
         "lon": cur_lon,
         "last_idx": last_idx,
         "etas": etas
+    }
+
+# ------------------------------
+# STATIC ROUTE GEOMETRY (cacheable)
+# ------------------------------
+# Stops (ids, names, coordinates) and segment lengths of every route never change while the
+# process runs, so clients fetch them once — /routes for the whole network, /route/<bus_id> for
+# one bus — and revalidate with the ETag (a hash of the network) after GEOMETRY_MAX_AGE.
+GEOMETRY_MAX_AGE = 3600
+
+def build_route_geometry(bid):
+    index = route_index[bid]
+    return {
+        "bus_id": bid,
+        "name": buses[bid]["name"],
+        "route": buses[bid]["route"],
+        "loop_m": index["loop_m"],
+        "stops": [{"index": i, "id": stop["id"], "name": stop["name"], "lat": stop["lat"], "lon": stop["lon"],
+                   "seg_m": index["seg_m"][i]} for i, stop in enumerate(routes[bid])]
+    }
+
+route_geometry = {bid: build_route_geometry(bid) for bid in routes}
+GEOMETRY_ETAG = hashlib.sha1(json.dumps(route_geometry, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+geometry_variants = {}  # bus_id (None: every route) -> encoded bodies
+
+@app.route("/routes", methods=["GET"])
+@app.route("/route/<bus_id>", methods=["GET"])
+def route_geometry_view(bus_id=None):
+    """Static geometry of one route (or of all routes, keyed by bus id); takes ?fields= like the other read endpoints."""
+    if bus_id is not None and bus_id not in routes:
+        return jsonify({"error": "Bus not found"}), 404
+    fields = codec.parse_fields(request.args.get("fields"))
+    if bus_id is None:
+        build = lambda: {bid: codec.project(geo, fields) for bid, geo in route_geometry.items()}
+    else:
+        build = lambda: codec.project(route_geometry[bus_id], fields)
+    return encoded_response(build, etag=f"geo-{bus_id or 'all'}-{GEOMETRY_ETAG}",
+                            variants=geometry_variants.setdefault(bus_id, {}),
+                            variant=(codec.fields_key(fields),), max_age=GEOMETRY_MAX_AGE)
+
+# ------------------------------
+# STOP ARRIVALS (departure boards)
+# ------------------------------
+# A stop's board only looks at the buses serving it (stop_routes). The sorted arrivals are
+# computed at most once per simulator tick and shared by every kiosk polling that stop;
+# seat counts are added per request, so they are never a tick behind.
+MAX_ARRIVALS = 50
+arrivals_cache = {}  # stop_id -> {"tick": int, "arrivals": [...]}
+
+def next_arrival(bid, idx, state):
+    """(distance_m, eta_sec) until bus bid next reaches stop idx, for a bus_state snapshot; (0, 0) while it is at the stop."""
+    route = routes[bid]
+    stop = route[idx]
+    cur_lat, cur_lon, last_idx = state["lat"], state["lon"], state["last_idx"]
+    if last_idx == idx and haversine(cur_lat, cur_lon, stop["lat"], stop["lon"]) <= REACHED_THRESHOLD_M:
+        return 0, 0
+    next_idx = (last_idx + 1) % len(route)
+    to_next_m = haversine(cur_lat, cur_lon, route[next_idx]["lat"], route[next_idx]["lon"])
+    table = speed_profiles.table()
+    rem_d = to_next_m + distance_between_stops(bid, next_idx, idx)
+    eta = seconds_to_next_stop(bid, last_idx, to_next_m, table) + seconds_between_stops(bid, next_idx, idx, table)
+    return int(rem_d), int(eta)
+
+def stop_arrivals(stop_id):
+    """{"tick", "arrivals"} for stop_id, soonest first — rebuilt only when sim_tick moved."""
+    tick = sim_tick
+    cached = arrivals_cache.get(stop_id)
+    if cached is None or cached["tick"] != tick:
+        arrivals = []
+        for bid, idx in stop_routes.get(stop_id, ()):
+            distance_m, eta_sec = next_arrival(bid, idx, bus_state[bid])
+            arrivals.append({
+                "bus_id": bid,
+                "name": buses[bid]["name"],
+                "route": buses[bid]["route"],
+                "stop_index": idx,
+                "distance_m": distance_m,
+                "eta_sec": eta_sec
+            })
+        arrivals.sort(key=lambda a: (a["eta_sec"], a["bus_id"]))
+        cached = {"tick": tick, "arrivals": arrivals}
+        arrivals_cache[stop_id] = cached
+    return cached
+
+@app.route("/stop/<stop_id>/arrivals", methods=["GET"])
+def stop_arrivals_board(stop_id):
+    """Next ?limit= (default 10) arrivals at stop_id across all buses, soonest first."""
+    if stop_id not in stops:
+        return jsonify({"error": "Stop not found"}), 404
+    limit = max(1, min(request.args.get("limit", 10, type=int), MAX_ARRIVALS))
+    cached = stop_arrivals(stop_id)
+    return jsonify({
+        "stop": stops[stop_id],
+        "tick": cached["tick"],
+        "arrivals": [dict(a, available_seats=buses[a["bus_id"]]["available_seats"]) for a in cached["arrivals"][:limit]]
     })
 
+# ------------------------------
+# NEARBY QUERIES (grid spatial index)
+# ------------------------------
+MAX_NEARBY_RADIUS_M = 20000.0
+
+def query_point():
+    """
+    (lat, lon, radius_m, limit) from the query string, or None when lat/lon are missing, not
+    numbers or out of range (NaN/inf would break the grid lookup), or the radius is not a
+    finite number >= 0. The radius is capped at MAX_NEARBY_RADIUS_M and limit is at least 1.
+    """
+    try:
+        lat, lon = float(request.args["lat"]), float(request.args["lon"])
+        radius = float(request.args.get("radius", 500))
+        limit = max(1, int(request.args.get("limit", 20)))
+    except (KeyError, ValueError):
+        return None
+    if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0 and 0.0 <= radius < math.inf):
+        return None
+    return lat, lon, min(radius, MAX_NEARBY_RADIUS_M), limit
+
+def stop_entries(idx, dist):
+    return [dict(stops[stop_ids[i]], distance_m=int(d)) for i, d in zip(idx.tolist(), dist.tolist())]
+
+@app.route("/stops/nearby", methods=["GET"])
+def stops_nearby():
+    """Stops within ?radius= meters (default 500) of ?lat=&lon=, nearest first (at most ?limit=, default 20)."""
+    q = query_point()
+    if q is None:
+        return jsonify({"error": "lat/lon (and radius) query parameters are required and must be in range"}), 400
+    lat, lon, radius, limit = q
+    return jsonify({"stops": stop_entries(*stop_index.query_radius(lat, lon, radius, limit))})
+
+@app.route("/stops/nearest", methods=["GET"])
+def stops_nearest():
+    """The ?k= (default 1) stops nearest to ?lat=&lon=, searched up to MAX_NEARBY_RADIUS_M away."""
+    q = query_point()
+    if q is None:
+        return jsonify({"error": "lat/lon (and radius) query parameters are required and must be in range"}), 400
+    lat, lon, _, _ = q
+    k = max(1, request.args.get("k", 1, type=int))
+    return jsonify({"stops": stop_entries(*stop_index.nearest(lat, lon, k, MAX_NEARBY_RADIUS_M))})
+
+@app.route("/buses/nearby", methods=["GET"])
+def buses_nearby():
+    """Live buses within ?radius= meters (default 500) of ?lat=&lon=, nearest first (at most ?limit=)."""
+    q = query_point()
+    if q is None:
+        return jsonify({"error": "lat/lon (and radius) query parameters are required and must be in range"}), 400
+    lat, lon, radius, limit = q
+    idx, dist = bus_index.query_radius(lat, lon, radius, limit)
+    result = []
+    for i, d in zip(idx.tolist(), dist.tolist()):
+        bid = fleet.bus_ids[i]
+        state = bus_state[bid]
+        result.append({
+            "bus_id": bid,
+            "name": buses[bid]["name"],
+            "lat": state["lat"],
+            "lon": state["lon"],
+            "last_idx": state["last_idx"],
+            "available_seats": buses[bid]["available_seats"],
+            "distance_m": int(d)
+        })
+    return jsonify({"buses": result})
+
 # ------------------------------
 # RUN SERVER (MUST BE LAST)
 # ------------------------------
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # No reloader: its parent process would import this module too and run a second simulator
+    # writing the same state file and seat log.
+    app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
@@ -0,0 +1,145 @@
+# asgi.py
+"""
+ASGI serving mode for the Smart Bus backend.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+
+All HTTP routes (/buses, /bus/<id>, /update_seats, /live_status/<id>, ...) are the Flask
+views from app.py, wrapped with a2wsgi, so their responses are unchanged. The views run on a
+pool of BUS_WSGI_THREADS threads (default 32), so one slow view (a forwarded write waiting on
+the owner, a seat-log fsync or compaction) holds up one thread, not every poller. Two things
+differ from `python app.py`:
+  - the simulator runs as an asyncio task on the server's event loop (no extra thread
+    competing with request handlers), and
+  - /stream is served natively on the event loop, so thousands of open SSE connections
+    cost one coroutine each instead of one thread each.
+"""
+import os
+os.environ.setdefault("BUS_SIMULATOR", "asyncio")  # must be set before app.py is imported
+
+import asyncio
+from urllib.parse import parse_qs
+from a2wsgi import WSGIMiddleware
+
+import app as backend
+
+SIM_DT = float(os.environ.get("BUS_SIM_DT", "1.0"))
+WSGI_THREADS = int(os.environ.get("BUS_WSGI_THREADS", "32"))
+
+flask_asgi = WSGIMiddleware(backend.app, workers=WSGI_THREADS)
+
+
+# ---------------------------
+# Simulator task
+# ---------------------------
+async def simulate_task(dt):
+    """Asyncio counterpart of app.simulate_loop: one vectorized tick every dt seconds."""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        backend.simulate_tick(dt)
+        await asyncio.sleep(max(0.0, dt - (loop.time() - started)))
+
+
+class AsyncWakeup:
+    """Wakes every waiting stream coroutine when the broadcaster publishes (from any thread)."""
+
+    def __init__(self):
+        self._event = asyncio.Event()
+
+    def notify(self):
+        event, self._event = self._event, asyncio.Event()
+        event.set()
+
+    async def wait(self, disconnected, timeout):
+        """Wait for the next publish; returns False on timeout."""
+        waiter = asyncio.ensure_future(self._event.wait())
+        done, _ = await asyncio.wait({waiter, disconnected}, timeout=timeout,
+                                     return_when=asyncio.FIRST_COMPLETED)
+        waiter.cancel()
+        return bool(done)
+
+
+wakeup = None
+
+
+# ---------------------------
+# Native /stream handler
+# ---------------------------
+def stream_topics(scope):
+    """Bus ids requested from /stream, /stream/<bus_id> or /stream?bus_id=..; None when not a stream request."""
+    path = scope["path"].rstrip("/")
+    if path == "/stream":
+        return parse_qs(scope["query_string"].decode()).get("bus_id") or list(backend.routes.keys())
+    if path.startswith("/stream/") and path.count("/") == 2:
+        return [path.split("/")[2]]
+    return None
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def stream(scope, receive, send, wanted):
+    """Same event stream as app.stream, driven by the event loop instead of a blocked thread."""
+    topics = set(wanted)
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream; charset=utf-8"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"),
+            (b"access-control-allow-origin", b"*"),
+        ],
+    })
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        cursor = backend.broadcaster.seq
+        await send({"type": "http.response.body", "body": backend.stream_snapshot(wanted, cursor).encode(),
+                    "more_body": True})
+        while not disconnected.done():
+            frames, cursor = backend.broadcaster.frames_since(cursor, topics)
+            if frames:
+                body = "".join(frames)
+            elif await wakeup.wait(disconnected, backend.STREAM_KEEPALIVE_SEC):
+                continue
+            else:
+                body = ": keep-alive\n\n"
+            await send({"type": "http.response.body", "body": body.encode(), "more_body": True})
+    finally:
+        disconnected.cancel()
+
+
+# ---------------------------
+# ASGI entry point
+# ---------------------------
+async def lifespan(receive, send):
+    global wakeup
+    sim = None
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            loop = asyncio.get_running_loop()
+            wakeup = AsyncWakeup()
+            backend.broadcaster.add_listener(lambda seq: loop.call_soon_threadsafe(wakeup.notify))
+            if backend.SIMULATOR_MODE == "asyncio":
+                sim = asyncio.create_task(simulate_task(SIM_DT))
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if sim is not None:
+                sim.cancel()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] == "http" and scope["method"] == "GET" and wakeup is not None:
+        wanted = stream_topics(scope)
+        if wanted and all(bid in backend.routes for bid in wanted):
+            return await stream(scope, receive, send, wanted)
+    # Everything else (including unknown-bus errors) is answered by the Flask views
+    return await flask_asgi(scope, receive, send)
@@ -0,0 +1,243 @@
+# benchmark.py
+"""
+Benchmark harness for the Smart Bus backend.
+
+    python benchmark.py --buses 2000 --stops 40 --out benchmark.json
+    python benchmark.py --buses 2000 --stops 40 --compare benchmark.json
+
+Generates a synthetic network (same network.json shape as data/network.json, with stops shared
+between routes), loads app.py against it with the background simulator and all persistence off,
+and measures:
+  - advance_bus_one_tick (per bus) and simulate_tick (one tick of simulate_loop for the whole fleet)
+  - remaining_distance_along_route
+  - /live_status/<bus_id> through the Flask test client: cold (state changed), warm (cached body)
+    and 304 (matching If-None-Match)
+  - /update_seats and /update_seats/batch throughput through the Flask test client
+  - /gps/batch ingestion throughput (one fix per bus per batch, i.e. a 1 Hz fleet-wide round)
+
+Results (p50/p99/mean per operation, plus throughput) are written as JSON together with the
+parameters, git commit and Python version, so runs of different versions can be diffed or
+compared with --compare.
+"""
+import argparse, json, math, os, platform, random, subprocess, tempfile, time
+import numpy as np
+
+CENTER = (12.97, 79.14)  # Vellore
+M_PER_DEG_LAT = 6371.0 * 1000.0 * math.pi / 180.0
+
+
+# ------------------------------
+# SYNTHETIC NETWORK
+# ------------------------------
+def make_network(n_buses, stops_per_route, seed=0, share=0.25, spacing_m=(300.0, 900.0)):
+    """
+    network.json dict with n_buses routes of stops_per_route stops each. Routes are random walks
+    across a city-sized area; about 'share' of the stops of a route are existing stops of earlier
+    routes (interchanges), the rest are new.
+    """
+    rng = random.Random(seed)
+    stops, buses = [], []
+    span_deg = 0.15  # ~16 km across
+    for b in range(n_buses):
+        lat = CENTER[0] + rng.uniform(-span_deg, span_deg) / 2
+        lon = CENTER[1] + rng.uniform(-span_deg, span_deg) / 2
+        heading = rng.uniform(0, 2 * math.pi)
+        route = []
+        for _ in range(stops_per_route):
+            if stops and rng.random() < share:
+                s = rng.choice(stops)
+                if s["id"] not in route:
+                    route.append(s["id"])
+                    lat, lon = s["lat"], s["lon"]
+                    continue
+            step = rng.uniform(*spacing_m)
+            heading += rng.uniform(-0.6, 0.6)
+            lat += step * math.cos(heading) / M_PER_DEG_LAT
+            lon += step * math.sin(heading) / (M_PER_DEG_LAT * math.cos(math.radians(lat)))
+            sid = f"s{len(stops)}"
+            stops.append({"id": sid, "name": f"Stop {len(stops)}", "lat": lat, "lon": lon})
+            route.append(sid)
+        buses.append({"id": f"Bus{b}", "name": f"Bus {b}", "route": f"Route {b}",
+                      "total_seats": 42, "available_seats": 42, "stops": route})
+    return {"stops": stops, "buses": buses}
+
+
+def load_backend(network, workdir):
+    """Import app.py against 'network' with the simulator thread, seat log, state file and saved speed profiles disabled."""
+    path = os.path.join(workdir, "network.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(network, f)
+    os.environ.update(BUS_NETWORK=path, BUS_SIMULATOR="none", SEAT_EVENT_LOG="", BUS_STATE_FILE="",
+                      BUS_SPEED_PROFILES="")
+    import app as backend
+    return backend
+
+
+# ------------------------------
+# MEASUREMENT
+# ------------------------------
+def summarize(samples_s, **extra):
+    """p50/p99/mean in microseconds of per-call durations (seconds)."""
+    a = np.asarray(samples_s) * 1e6
+    return dict({"n": int(a.size), "p50_us": float(np.percentile(a, 50)), "p99_us": float(np.percentile(a, 99)),
+                 "mean_us": float(a.mean())}, **extra)
+
+
+def time_calls(fn, args_list):
+    samples = []
+    clock = time.perf_counter
+    for args in args_list:
+        t0 = clock()
+        fn(*args)
+        samples.append(clock() - t0)
+    return samples
+
+
+def bench_simulator(backend, ticks):
+    bus_ids = list(backend.routes)
+    per_bus = time_calls(backend.advance_bus_one_tick, [(bid, 1.0) for bid in bus_ids])
+    tick = time_calls(backend.simulate_tick, [(1.0,)] * ticks)
+    return {
+        "advance_bus_one_tick": summarize(per_bus, fleet_pass_ms=sum(per_bus) * 1e3),
+        "simulate_tick": summarize(tick, buses_per_sec=len(bus_ids) / float(np.mean(tick))),
+    }
+
+
+def bench_eta(backend, samples, rng):
+    bus_ids = list(backend.routes)
+    args = []
+    for _ in range(samples):
+        bid = rng.choice(bus_ids)
+        args.append((bid, rng.randrange(len(backend.routes[bid]))))
+    return {"remaining_distance_along_route": summarize(time_calls(backend.remaining_distance_along_route, args))}
+
+
+def bench_live_status(backend, samples, rng):
+    client = backend.app.test_client()
+    bus_ids = [rng.choice(list(backend.routes)) for _ in range(samples)]
+    backend.simulate_tick(1.0)  # new versions: every first request rebuilds the body
+    cold = time_calls(lambda bid: client.get(f"/live_status/{bid}"), [(bid,) for bid in dict.fromkeys(bus_ids)])
+    warm = time_calls(lambda bid: client.get(f"/live_status/{bid}"), [(bid,) for bid in bus_ids])
+    etags = {bid: backend.live_status_cache[bid]["etag"] for bid in bus_ids}
+    not_modified = time_calls(lambda bid: client.get(f"/live_status/{bid}", headers={"If-None-Match": f'"{etags[bid]}"'}),
+                              [(bid,) for bid in bus_ids])
+    return {"live_status_cold": summarize(cold), "live_status_warm": summarize(warm),
+            "live_status_304": summarize(not_modified)}
+
+
+def bench_seats(backend, requests, batch_size, rng):
+    client = backend.app.test_client()
+    bus_ids = list(backend.routes)
+    single = [({"event_id": f"bench-{i}", "bus_id": rng.choice(bus_ids), "boarded": rng.randint(0, 3),
+                "alighted": rng.randint(0, 3)},) for i in range(requests)]
+    started = time.perf_counter()
+    samples = time_calls(lambda body: client.post("/update_seats", json=body), single)
+    single_elapsed = time.perf_counter() - started
+
+    batches = []
+    for b in range(max(1, requests // batch_size)):
+        batches.append(({"events": [{"event_id": f"bench-batch-{b}-{i}", "bus_id": rng.choice(bus_ids),
+                                     "boarded": rng.randint(0, 3), "alighted": rng.randint(0, 3)}
+                                    for i in range(batch_size)]},))
+    started = time.perf_counter()
+    batch_samples = time_calls(lambda body: client.post("/update_seats/batch", json=body), batches)
+    batch_elapsed = time.perf_counter() - started
+    return {
+        "update_seats": summarize(samples, requests_per_sec=len(single) / single_elapsed),
+        "update_seats_batch": summarize(batch_samples, batch_size=batch_size,
+                                        events_per_sec=len(batches) * batch_size / batch_elapsed),
+    }
+
+
+def bench_gps(backend, rounds, rng):
+    """
+    Each round posts one fix per bus, a little ahead of its current position with some GPS noise,
+    one second after the previous round (ending now, inside the server's GPS timestamp window).
+    """
+    client = backend.app.test_client()
+    bus_ids = list(backend.routes)
+    samples = []
+    start = time.time() - rounds
+    for r in range(rounds):
+        pings = []
+        for bid in bus_ids:
+            state, route = backend.bus_state[bid], backend.routes[bid]
+            nxt = route[(state["last_idx"] + 1) % len(route)]
+            pings.append({"bus_id": bid, "timestamp": start + r,
+                          "lat": state["lat"] + (nxt["lat"] - state["lat"]) * 0.05 + rng.gauss(0, 5e-5),
+                          "lon": state["lon"] + (nxt["lon"] - state["lon"]) * 0.05 + rng.gauss(0, 5e-5)})
+        responses = []
+        samples.extend(time_calls(lambda body: responses.append(client.post("/gps/batch", json=body)),
+                                  [({"pings": pings},)]))
+        result = responses[0].get_json()
+        assert result["accepted"] == len(pings), f"gps round {r}: {result['accepted']} of {len(pings)} accepted"
+    return {"gps_batch": summarize(samples, batch_size=len(bus_ids),
+                                   pings_per_sec=len(bus_ids) / float(np.mean(samples)))}
+
+
+# ------------------------------
+# REPORTING
+# ------------------------------
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    for name, r in results.items():
+        line = f"{name:34s} p50 {r['p50_us']:10.1f} us   p99 {r['p99_us']:10.1f} us"
+        if baseline and name in baseline:
+            old = baseline[name]
+            line += f"   (p50 x{r['p50_us'] / old['p50_us']:.2f}, p99 x{r['p99_us'] / old['p99_us']:.2f} vs baseline)"
+        print(line)
+
+
+def run(args):
+    network = make_network(args.buses, args.stops, seed=args.seed)
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as workdir:
+        started = time.perf_counter()
+        backend = load_backend(network, workdir)
+        results = {"startup": summarize([time.perf_counter() - started])}
+        results.update(bench_simulator(backend, args.ticks))
+        results.update(bench_eta(backend, args.samples, rng))
+        results.update(bench_live_status(backend, args.samples, rng))
+        results.update(bench_seats(backend, args.seat_requests, args.batch_size, rng))
+        results.update(bench_gps(backend, args.gps_rounds, rng))
+
+    report = {
+        "meta": {"commit": git_commit(), "python": platform.python_version(), "platform": platform.platform(),
+                 "timestamp": time.time()},
+        "params": {"buses": args.buses, "stops_per_route": args.stops, "stops": len(network["stops"]),
+                   "ticks": args.ticks, "samples": args.samples, "seat_requests": args.seat_requests,
+                   "batch_size": args.batch_size, "gps_rounds": args.gps_rounds, "seed": args.seed},
+        "results": results,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.out}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Smart Bus backend benchmarks")
+    parser.add_argument("--buses", type=int, default=1000, help="routes / buses in the synthetic fleet")
+    parser.add_argument("--stops", type=int, default=30, help="stops per route")
+    parser.add_argument("--ticks", type=int, default=50, help="simulator ticks to time")
+    parser.add_argument("--samples", type=int, default=5000, help="ETA / live_status calls to time")
+    parser.add_argument("--seat-requests", type=int, default=2000, help="/update_seats requests to time")
+    parser.add_argument("--batch-size", type=int, default=100, help="events per /update_seats/batch request")
+    parser.add_argument("--gps-rounds", type=int, default=10, help="fleet-wide /gps/batch rounds to time")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="benchmark.json", help="JSON results file ('' to skip)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    run(parser.parse_args())
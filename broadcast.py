@@ -0,0 +1,66 @@
+# broadcast.py
+import json, threading
+from collections import deque
+from itertools import islice
+
+# ------------------------------
+# SHARED LIVE-UPDATE BROADCASTER
+# ------------------------------
+# Every update is serialized once into a ready-to-send Server-Sent Events frame and kept
+# in a bounded ring of recent events. A subscriber is only a sequence cursor waiting on one
+# shared Condition, so an open stream costs almost nothing beyond its connection.
+
+
+class Broadcaster:
+    """Fan-out point for live bus updates (positions from the simulator, seat counts from /update_seats)."""
+
+    def __init__(self, history=4096):
+        self._cond = threading.Condition()
+        self._events = deque(maxlen=history)  # (seq, topic, frame)
+        self.seq = 0
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Register callback(seq), called after every publish (e.g. to wake subscribers on an asyncio loop)."""
+        self._listeners.append(callback)
+
+    def publish(self, topic, event, data):
+        """Publish one event for 'topic' (a bus id); 'event' is the SSE event name, 'data' a JSON-able dict."""
+        self.publish_many([(topic, event, data)])
+
+    def publish_many(self, items):
+        """Publish several (topic, event, data) items with a single wake-up of the waiting subscribers."""
+        with self._cond:
+            for topic, event, data in items:
+                self.seq += 1
+                self._events.append((self.seq, topic, format_sse(event, data, self.seq)))
+            seq = self.seq
+            self._cond.notify_all()
+        for callback in self._listeners:
+            callback(seq)
+
+    def frames_since(self, cursor, topics=None):
+        """
+        Return (frames, new_cursor): the SSE frames published after 'cursor', optionally restricted
+        to a set of topics. Events that already fell out of the ring are skipped.
+        """
+        with self._cond:
+            if not self._events or cursor >= self.seq:
+                return [], self.seq
+            first = self._events[0][0]
+            recent = list(islice(self._events, max(0, cursor - first + 1), None))
+            cursor = self.seq
+        if topics is None:
+            return [frame for _, _, frame in recent], cursor
+        return [frame for _, topic, frame in recent if topic in topics], cursor
+
+    def wait(self, cursor, timeout):
+        """Block until something newer than 'cursor' is published; False if 'timeout' seconds passed first."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.seq > cursor, timeout)
+
+
+def format_sse(event, data, seq=None):
+    """Serialize one Server-Sent Events frame (compact JSON payload)."""
+    head = f"id: {seq}\n" if seq is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
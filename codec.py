@@ -0,0 +1,98 @@
+# codec.py
+import gzip, hashlib
+
+try:
+    import brotli
+except ImportError:  # optional: without it only gzip is offered
+    brotli = None
+try:
+    import msgpack
+except ImportError:  # optional: without it every response is JSON
+    msgpack = None
+
+# ------------------------------
+# RESPONSE REPRESENTATIONS (format, compression, field projection)
+# ------------------------------
+# A representation is picked per request from:
+#   format       ?format=msgpack|json, else the Accept header (JSON unless MessagePack is preferred)
+#   compression  Accept-Encoding: br (when brotli is installed) or gzip; bodies under
+#                COMPRESS_MIN_BYTES are sent as they are
+#   projection   ?fields=a,b,c.d — keeps the named keys; "c.d" keeps key d of every item of list c
+
+COMPRESS_MIN_BYTES = 512
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+MIMETYPES = {"json": "application/json", "msgpack": "application/msgpack"}
+MSGPACK_MIMETYPES = ("application/msgpack", "application/x-msgpack")
+
+
+def negotiate_format(req):
+    """'msgpack' when asked for (and msgpack is installed), else 'json'."""
+    if msgpack is None:
+        return "json"
+    fmt = req.args.get("format")
+    if fmt:
+        return "msgpack" if fmt == "msgpack" else "json"
+    if "msgpack" not in req.headers.get("Accept", ""):
+        return "json"  # skip parsing the usual */* or application/json
+    best = req.accept_mimetypes.best_match(("application/json",) + MSGPACK_MIMETYPES)
+    return "msgpack" if best in MSGPACK_MIMETYPES else "json"
+
+
+def negotiate_encoding(req):
+    """'br', 'gzip' or 'identity', from the request's Accept-Encoding."""
+    if "Accept-Encoding" not in req.headers:
+        return "identity"
+    offered = ("br", "gzip") if brotli is not None else ("gzip",)
+    return req.accept_encodings.best_match(offered) or "identity"
+
+
+def pack(payload):
+    return msgpack.packb(payload, use_bin_type=True)
+
+
+def compress(body, encoding):
+    """(body, encoding actually applied) — small bodies stay uncompressed."""
+    if encoding == "identity" or len(body) < COMPRESS_MIN_BYTES:
+        return body, "identity"
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY), "br"
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0), "gzip"
+
+
+def parse_fields(spec):
+    """'lat,lon,etas.eta_sec' -> {"lat": {}, "lon": {}, "etas": {"eta_sec": {}}} (None: no projection)."""
+    tree = {}
+    for path in (spec or "").split(","):
+        node = tree
+        for part in path.strip().split("."):
+            if part:
+                node = node.setdefault(part, {})
+    return tree or None
+
+
+def fields_key(tree):
+    """Short stable id of a parsed projection ("" for none), for cache keys and ETags."""
+    if not tree:
+        return ""
+    return "f" + hashlib.sha1(repr(sorted(_paths(tree))).encode()).hexdigest()[:8]
+
+
+def _paths(tree, prefix=""):
+    for key, sub in tree.items():
+        path = prefix + key
+        if sub:
+            yield from _paths(sub, path + ".")
+        else:
+            yield path
+
+
+def project(value, tree):
+    """Keep only the keys named in 'tree' (an empty subtree keeps the whole value); lists are projected item by item."""
+    if not tree:
+        return value
+    if isinstance(value, dict):
+        return {key: project(value[key], sub) for key, sub in tree.items() if key in value}
+    if isinstance(value, list):
+        return [project(item, tree) for item in value]
+    return value
@@ -0,0 +1,99 @@
+# fleet_sim.py
+import numpy as np
+
+# ------------------------------
+# VECTORIZED FLEET SIMULATION ENGINE
+# ------------------------------
+# Same movement model as app.advance_bus_one_tick, but every bus is advanced in one
+# batched NumPy step instead of a Python loop with two haversine calls per bus.
+
+EARTH_RADIUS_M = 6371.0 * 1000.0
+
+
+def haversine_np(lat1, lon1, lat2, lon2):
+    """Element-wise haversine distance (meters) over NumPy arrays — same formula as app.haversine."""
+    dlat = np.radians(lat2 - lat1)
+    dlon = np.radians(lon2 - lon1)
+    a = np.sin(dlat / 2) ** 2 + np.cos(np.radians(lat1)) * np.cos(np.radians(lat2)) * np.sin(dlon / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return EARTH_RADIUS_M * c
+
+
+class FleetSimulator:
+    """
+    Holds every bus position, last passed stop index and the packed route geometry in flat arrays.
+    Stops of all routes are concatenated into stop_lat/stop_lon; bus i reads its stops at
+    route_offset[i] + stop index, with route_len[i] stops on its (looping) route.
+    """
+
+    def __init__(self, routes, speed_ms, reached_threshold_m):
+        self.bus_ids = list(routes.keys())
+        self.index = {bid: i for i, bid in enumerate(self.bus_ids)}
+        self.speed_ms = speed_ms
+        self.reached_threshold_m = reached_threshold_m
+
+        offsets, lengths, lats, lons = [], [], [], []
+        for bid in self.bus_ids:
+            route = routes[bid]
+            offsets.append(len(lats))
+            lengths.append(len(route))
+            lats.extend(s["lat"] for s in route)
+            lons.extend(s["lon"] for s in route)
+        self.route_offset = np.array(offsets, dtype=np.int64)
+        self.route_len = np.array(lengths, dtype=np.int64)
+        self.stop_lat = np.array(lats, dtype=np.float64)
+        self.stop_lon = np.array(lons, dtype=np.float64)
+
+        # Every bus starts at stop 0 of its route
+        self.last_idx = np.zeros(len(self.bus_ids), dtype=np.int64)
+        self.lat = self.stop_lat[self.route_offset].copy()
+        self.lon = self.stop_lon[self.route_offset].copy()
+
+    def set_position(self, bid, lat, lon, last_idx):
+        """Overwrite one bus (e.g. when restoring state that was produced outside the engine)."""
+        i = self.index[bid]
+        self.lat[i], self.lon[i], self.last_idx[i] = lat, lon, last_idx
+
+    def load_state(self, bus_state):
+        """Copy lat/lon/last_idx for every known bus from a bus_state-shaped dict."""
+        for bid, state in bus_state.items():
+            if bid in self.index:
+                self.set_position(bid, state["lat"], state["lon"], state["last_idx"])
+
+    def step(self, dt=1.0, hold=None):
+        """
+        Move every bus forward by dt seconds at speed_ms towards its next stop.
+        A bus snaps onto the next stop (and marks it passed) when it was already within 0.5 m of it,
+        or when it ends the step within reached_threshold_m of it. Returns the boolean mask of buses
+        that passed a stop during this step. Buses in the boolean mask 'hold' (positioned by GPS)
+        are left where they are.
+        """
+        next_idx = (self.last_idx + 1) % self.route_len
+        g = self.route_offset + next_idx
+        lat_next, lon_next = self.stop_lat[g], self.stop_lon[g]
+
+        dist_to_next = haversine_np(self.lat, self.lon, lat_next, lon_next)
+
+        # Move along segment proportionally (buses already on the stop get frac=inf/nan and snap below)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            frac = np.minimum(1.0, (self.speed_ms * dt) / dist_to_next)
+        new_lat = self.lat + (lat_next - self.lat) * frac
+        new_lon = self.lon + (lon_next - self.lon) * frac
+
+        reached = dist_to_next < 0.5
+        moving = ~reached
+        reached[moving] = haversine_np(new_lat[moving], new_lon[moving],
+                                       lat_next[moving], lon_next[moving]) <= self.reached_threshold_m
+        if hold is not None:
+            reached &= ~hold
+            new_lat = np.where(hold, self.lat, new_lat)
+            new_lon = np.where(hold, self.lon, new_lon)
+
+        self.lat = np.where(reached, lat_next, new_lat)
+        self.lon = np.where(reached, lon_next, new_lon)
+        self.last_idx = np.where(reached, next_idx, self.last_idx)
+        return reached
+
+    def iter_states(self):
+        """Yield (bus_id, lat, lon, last_idx) as plain Python values (JSON-serializable)."""
+        return zip(self.bus_ids, self.lat.tolist(), self.lon.tolist(), self.last_idx.tolist())
@@ -0,0 +1,135 @@
+# history.py
+import os, threading, time
+import numpy as np
+
+# ------------------------------
+# POSITION HISTORY (fixed-capacity ring buffers in preallocated arrays)
+# ------------------------------
+# One row per bus (fleet order) and one column per slot in each field array, so memory is
+# allocated once and never grows:
+#   ts        uint32   unix seconds            4 bytes
+#   lat, lon  float32  ~1 m resolution          8 bytes
+#   last_idx  int16                             2 bytes
+#   seats     int16                             2 bytes
+# 16 bytes per point: a day of 1 Hz points (capacity 86400) is ~1.4 MB per bus, ~4.1 GB for 3000 buses.
+# head[i] counts every point bus i ever appended; slot = head % capacity.
+#
+# Optional spill: before a bus's ring wraps (and every spill_every seconds) the points not yet
+# spilled are written to spill_dir as one columnar .npz per spill — arrays bus (row number),
+# ts, lat, lon, last_idx, available_seats, plus bus_ids to map rows back to bus ids.
+
+FIELDS = (("ts", np.uint32), ("lat", np.float32), ("lon", np.float32),
+          ("last_idx", np.int16), ("available_seats", np.int16))
+POINT_BYTES = sum(np.dtype(dtype).itemsize for _, dtype in FIELDS)
+
+
+class PositionHistory:
+    def __init__(self, bus_ids, capacity, spill_dir=None, spill_every=300.0):
+        self.bus_ids = list(bus_ids)
+        self.index = {bid: i for i, bid in enumerate(self.bus_ids)}
+        self.capacity = capacity
+        n = len(self.bus_ids)
+        self.columns = {name: np.zeros((n, capacity), dtype=dtype) for name, dtype in FIELDS}
+        self.head = np.zeros(n, dtype=np.int64)
+        self.spilled = np.zeros(n, dtype=np.int64)
+        self.spill_dir = spill_dir
+        self.spill_every = spill_every
+        self._last_spill = time.time()
+        self._spill_lock = threading.Lock()
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    @property
+    def nbytes(self):
+        return sum(col.nbytes for col in self.columns.values())
+
+    def append(self, rows, ts, lat, lon, last_idx, available_seats):
+        """
+        Append one point for each entry of 'rows' (array of row numbers). A row may repeat: its
+        points are appended in the order given. Timestamps are clamped so each bus's history stays
+        in time order.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if rows.size == 0 or self.capacity == 0:
+            return
+        # k-th occurrence of each row, so every pass below touches each bus at most once
+        order = np.argsort(rows, kind="stable")
+        sorted_rows = rows[order]
+        pos = np.arange(rows.size)
+        first = np.maximum.accumulate(np.where(np.r_[True, sorted_rows[1:] != sorted_rows[:-1]], pos, 0))
+        rank = np.empty_like(pos)
+        rank[order] = pos - first
+        if not rank.any():
+            self._append(rows, ts, lat, lon, last_idx, available_seats)
+            return
+        values = [np.broadcast_to(np.asarray(v), rows.shape) for v in (ts, lat, lon, last_idx, available_seats)]
+        for k in range(int(rank.max()) + 1):
+            sel = rank == k
+            self._append(rows[sel], *(v[sel] for v in values))
+
+    def _append(self, rows, ts, lat, lon, last_idx, available_seats):
+        """append() for rows that are all distinct."""
+        if self.spill_dir and (self.head[rows] - self.spilled[rows] >= self.capacity).any():
+            self.spill()  # about to overwrite points that were never spilled
+        cols = self.head[rows] % self.capacity
+        prev = self.columns["ts"][rows, (self.head[rows] - 1) % self.capacity]
+        ts = np.maximum(np.asarray(ts, dtype=np.float64), np.where(self.head[rows] > 0, prev, 0))
+        self.columns["ts"][rows, cols] = ts
+        self.columns["lat"][rows, cols] = lat
+        self.columns["lon"][rows, cols] = lon
+        self.columns["last_idx"][rows, cols] = last_idx
+        self.columns["available_seats"][rows, cols] = available_seats
+        self.head[rows] += 1
+
+    def query(self, bid, start=None, end=None, step=None, limit=None):
+        """
+        Points of bus 'bid' with start <= ts <= end, oldest first, as {field: list}.
+        step keeps the first point of every 'step' seconds; limit then thins the result evenly
+        (always keeping the newest point) to at most 'limit' points.
+        """
+        i = self.index[bid]
+        head = int(self.head[i])
+        count = min(head, self.capacity)
+        order = (head - count + np.arange(count)) % self.capacity
+        ts = self.columns["ts"][i, order]
+        lo = 0 if start is None else int(np.searchsorted(ts, start, side="left"))
+        hi = count if end is None else int(np.searchsorted(ts, end, side="right"))
+        sel = order[lo:hi]
+        if step and sel.size:
+            bucket = np.floor(self.columns["ts"][i, sel] / step)
+            sel = sel[np.r_[True, bucket[1:] != bucket[:-1]]]
+        if limit and sel.size > limit:
+            sel = sel[np.linspace(0, sel.size - 1, limit).round().astype(np.int64)]
+        out = {name: self.columns[name][i, sel] for name, _ in FIELDS}
+        out["lat"] = out["lat"].astype(np.float64).round(6)  # float32 -> the ~1 m it actually holds
+        out["lon"] = out["lon"].astype(np.float64).round(6)
+        return {name: col.tolist() for name, col in out.items()}
+
+    # ---------------------------
+    # Columnar spill
+    # ---------------------------
+    def maybe_spill(self):
+        """Spill when spill_every seconds have passed since the last spill (called periodically)."""
+        if self.spill_dir and time.time() - self._last_spill >= self.spill_every:
+            self.spill()
+
+    def spill(self):
+        """Write every point not spilled yet to one .npz file in spill_dir; returns its path (None if nothing to write)."""
+        with self._spill_lock:
+            self._last_spill = time.time()
+            head = self.head.copy()
+            start = np.maximum(self.spilled, head - self.capacity)  # points already overwritten are lost
+            counts = head - start
+            total = int(counts.sum())
+            if not self.spill_dir or total == 0:
+                return None
+            rows = np.repeat(np.arange(len(self.bus_ids)), counts)
+            slots = (np.repeat(start - np.cumsum(counts) + counts, counts) + np.arange(total)) % self.capacity
+            out = {name: self.columns[name][rows, slots] for name, _ in FIELDS}
+            first, last = int(out["ts"].min()), int(out["ts"].max())
+            path = os.path.join(self.spill_dir, f"history-{first}-{last}.npz")
+            tmp = path + ".tmp.npz"
+            np.savez(tmp, bus=rows.astype(np.int32), bus_ids=np.array(self.bus_ids), **out)
+            os.replace(tmp, path)
+            self.spilled = head
+            return path
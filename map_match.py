@@ -0,0 +1,115 @@
+# map_match.py
+import math
+import numpy as np
+from spatial import M_PER_DEG_LAT
+
+# ------------------------------
+# ROUTE SEGMENT INDEX (GPS map-matching)
+# ------------------------------
+# Every route is a loop of straight segments, segment k running from stop k to stop k+1 (the last
+# one closes the loop). The segment endpoints are projected once into a flat local frame (meters,
+# equirectangular around the network's mean latitude) and every segment is filed, per route, in
+# the grid cells it passes through. Snapping a fix only looks at the segments of its route in the
+# 3x3 cells around it — one small vectorized point-to-segment projection, whatever the route length.
+# A route's cells are kept as sorted int64 keys (cell_key) with the segment numbers of each cell in
+# one array, so the whole network is indexed in a few numpy passes rather than per cell.
+
+NEIGHBOUR_DY = np.repeat(np.array([-1, 0, 1], dtype=np.int64), 3)  # 3x3 cells, in key order
+NEIGHBOUR_DX = np.tile(np.array([-1, 0, 1], dtype=np.int64), 3)
+
+
+def cell_key(cy, cx):
+    """int64 key of grid cell(s) (cy, cx), ordered like (cy, cx) tuples."""
+    return np.asarray(cy, dtype=np.int64) * (1 << 32) + (np.asarray(cx, dtype=np.int64) + (1 << 31))
+
+
+class RouteSegmentIndex:
+    def __init__(self, routes, cell_m=300.0):
+        self.cell_m = cell_m
+        lats = [s["lat"] for r in routes.values() for s in r]
+        self.ref_lat = float(np.mean(lats)) if lats else 0.0
+        self.kx = M_PER_DEG_LAT * math.cos(math.radians(self.ref_lat))  # meters per degree of longitude
+        self.ky = M_PER_DEG_LAT
+        self.routes = self._index_routes(routes)
+
+    def _index_routes(self, routes):
+        """Per-route segment arrays and grid cells, built for the whole network in one vectorized pass."""
+        bids = list(routes)
+        lens = np.array([len(routes[bid]) for bid in bids], dtype=np.int64)
+        first = np.repeat(np.cumsum(lens) - lens, lens)  # flat index of the first stop of each stop's route
+        ax = np.array([s["lon"] for bid in bids for s in routes[bid]], dtype=np.float64) * self.kx
+        ay = np.array([s["lat"] for bid in bids for s in routes[bid]], dtype=np.float64) * self.ky
+        flat = np.arange(ax.size)
+        k = flat - first                                       # segment number within its route
+        nxt = first + (k + 1) % np.repeat(lens, lens)
+        dx, dy = ax[nxt] - ax, ay[nxt] - ay
+
+        # Walk along every segment in quarter-cell steps and file it in every cell it crosses
+        steps = np.maximum(1, (np.hypot(dx, dy) / (self.cell_m / 4)).astype(np.int64))
+        seg = np.repeat(flat, steps + 1)
+        s = np.arange(seg.size) - np.repeat(np.cumsum(steps + 1) - (steps + 1), steps + 1)
+        cy = np.floor((ay[seg] + dy[seg] * s / steps[seg]) / self.cell_m).astype(np.int64)
+        cx = np.floor((ax[seg] + dx[seg] * s / steps[seg]) / self.cell_m).astype(np.int64)
+        # A straight segment never comes back to a cell: dropping repeats of the previous sample's
+        # cell leaves each (segment, cell) pair once
+        new = np.r_[True, (seg[1:] != seg[:-1]) | (cy[1:] != cy[:-1]) | (cx[1:] != cx[:-1])]
+        seg, cy, cx = seg[new], cy[new], cx[new]
+        route = np.repeat(np.arange(len(bids)), lens)[seg]
+        # Stable sort by (route, cell): samples come in segment order, so each cell's segments stay sorted
+        y0, x0 = cy.min(initial=0), cx.min(initial=0)
+        cell = (cy - y0) * (cx.max(initial=0) - x0 + 1) + (cx - x0)
+        order = np.argsort(route * (cell.max(initial=0) + 1) + cell, kind="stable")
+        route, cy, cx, seg_k = route[order], cy[order], cx[order], k[seg[order]]
+        cell_start = np.r_[True, (route[1:] != route[:-1]) | (cy[1:] != cy[:-1]) | (cx[1:] != cx[:-1])]
+
+        # Each route gets its cells as sorted keys, with bounds into the segment numbers filed there
+        key = cell_key(cy, cx)
+        route_rows = np.searchsorted(route, np.arange(len(bids) + 1))
+        out, offset = {}, 0
+        for i, bid in enumerate(bids):
+            lo, hi, end = int(route_rows[i]), int(route_rows[i + 1]), offset + int(lens[i])
+            cells = lo + np.nonzero(cell_start[lo:hi])[0]
+            out[bid] = {
+                "ax": ax[offset:end], "ay": ay[offset:end], "dx": dx[offset:end], "dy": dy[offset:end],
+                "len2": dx[offset:end] ** 2 + dy[offset:end] ** 2,
+                "cell_keys": key[cells], "cell_bounds": np.r_[cells, hi] - lo, "cell_segs": seg_k[lo:hi],
+            }
+            offset = end
+        return out
+
+    def snap(self, bid, lat, lon, max_dist_m=None, prev_idx=None, lookahead=3, backtrack_penalty_m=50.0):
+        """
+        Snap a fix onto the route of bus 'bid'. Returns (segment index, fraction along the segment,
+        snapped lat, snapped lon, distance from the route in meters), or None when no segment is
+        within max_dist_m (at most cell_m). With prev_idx (the bus's current segment), segments
+        more than 'lookahead' segments ahead of it cost backtrack_penalty_m extra, so a bus on a road
+        its route uses in both directions keeps its direction.
+        """
+        r = self.routes[bid]
+        max_dist_m = self.cell_m if max_dist_m is None else min(max_dist_m, self.cell_m)
+        px, py = lon * self.kx, lat * self.ky
+        keys = r["cell_keys"]
+        if keys.size == 0:
+            return None
+        cy, cx = math.floor(py / self.cell_m), math.floor(px / self.cell_m)
+        around = cell_key(cy + NEIGHBOUR_DY, cx + NEIGHBOUR_DX)
+        pos = np.searchsorted(keys, around)
+        hit = pos[(pos < keys.size) & (keys[np.minimum(pos, keys.size - 1)] == around)]
+        if hit.size == 0:
+            return None
+        bounds, segs = r["cell_bounds"], r["cell_segs"]
+        found = [segs[bounds[h]:bounds[h + 1]] for h in hit.tolist()]
+        cand = np.unique(np.concatenate(found)) if len(found) > 1 else found[0]
+
+        ax, ay, dx, dy, len2 = r["ax"][cand], r["ay"][cand], r["dx"][cand], r["dy"][cand], r["len2"][cand]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = np.clip(np.where(len2 > 0, ((px - ax) * dx + (py - ay) * dy) / len2, 0.0), 0.0, 1.0)
+        qx, qy = ax + t * dx, ay + t * dy
+        dist = np.hypot(px - qx, py - qy)
+        if not (dist <= max_dist_m).any():
+            return None
+        score = np.where(dist <= max_dist_m, dist, np.inf)
+        if prev_idx is not None:
+            score += backtrack_penalty_m * (((cand - prev_idx) % len(r["ax"])) > lookahead)
+        best = int(np.argmin(score))
+        return int(cand[best]), float(t[best]), float(qy[best] / self.ky), float(qx[best] / self.kx), float(dist[best])
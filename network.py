@@ -0,0 +1,147 @@
+# network.py
+import csv, hashlib, json, os, pickle
+
+# ------------------------------
+# NETWORK LOADING (JSON or GTFS) + COMPILED CACHE
+# ------------------------------
+# One canonical model: every stop exists once (id, name, lat, lon) and each bus lists the stop ids
+# of its route in order. The parsed network is pickled into a .cache directory next to the source,
+# keyed by a hash of the source files, so a city-scale network is parsed once and afterwards loads
+# in a single pickle read.
+
+CACHE_FORMAT = 1  # bump when the in-memory shape changes, to invalidate old cache files
+DEFAULT_TOTAL_SEATS = 42  # GTFS has no seat information
+
+
+def load_network(path, cache_dir=None):
+    """
+    Load the bus network from 'path' — a network.json file or a GTFS directory — into the
+    in-memory shapes used by app.py:
+      stops[stop_id] = {"id", "name", "lat", "lon"}
+      routes[bus_id] = [stop dict, ...]                 (route order, shared with 'stops')
+      buses[bus_id]  = {"name", "route", "total_seats", "available_seats", "stops": [stop names]}
+    Returns {"stops": ..., "routes": ..., "buses": ...}.
+    """
+    files = _source_files(path)
+    digest = _hash_files(files)
+    if cache_dir is None:
+        base = path if os.path.isdir(path) else os.path.dirname(os.path.abspath(path))
+        cache_dir = os.path.join(base, ".cache")
+    cache_path = os.path.join(cache_dir, f"network-{digest}.pickle")
+
+    try:
+        with open(cache_path, "rb") as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+
+    network = _parse_gtfs(path) if os.path.isdir(path) else _parse_json(path)
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(network, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache_path)
+    except OSError:
+        pass  # read-only deployment: just parse every time
+    return network
+
+
+def _source_files(path):
+    if os.path.isdir(path):
+        return [os.path.join(path, name) for name in ("stops.txt", "routes.txt", "trips.txt", "stop_times.txt")]
+    return [path]
+
+
+def _hash_files(files):
+    h = hashlib.sha256(f"network-cache-v{CACHE_FORMAT}".encode())
+    for name in files:
+        with open(name, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    return h.hexdigest()[:16]
+
+
+def _build(stops, bus_defs):
+    """Assemble the canonical model from stops {id: stop} and [(bus_id, info dict, [stop ids])]."""
+    routes, buses = {}, {}
+    for bid, info, stop_ids in bus_defs:
+        missing = [sid for sid in stop_ids if sid not in stops]
+        if missing:
+            raise ValueError(f"Bus {bid} references unknown stops: {missing}")
+        if not stop_ids:
+            raise ValueError(f"Bus {bid} has no stops")
+        routes[bid] = [stops[sid] for sid in stop_ids]
+        buses[bid] = dict(info, stops=[stops[sid]["name"] for sid in stop_ids])
+    return {"stops": stops, "routes": routes, "buses": buses}
+
+
+def _parse_json(path):
+    """
+    network.json:
+      {"stops": [{"id", "name", "lat", "lon"}, ...],
+       "buses": [{"id", "name", "route", "total_seats", "available_seats", "stops": [stop ids]}, ...]}
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+    stops = {}
+    for s in raw["stops"]:
+        stops[s["id"]] = {"id": s["id"], "name": s["name"], "lat": float(s["lat"]), "lon": float(s["lon"])}
+    bus_defs = []
+    for b in raw["buses"]:
+        total = int(b.get("total_seats", DEFAULT_TOTAL_SEATS))
+        info = {
+            "name": b.get("name", b["id"]),
+            "route": b.get("route", ""),
+            "total_seats": total,
+            "available_seats": int(b.get("available_seats", total)),
+        }
+        bus_defs.append((b["id"], info, list(b["stops"])))
+    return _build(stops, bus_defs)
+
+
+def _read_csv(path):
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        yield from csv.DictReader(f)
+
+
+def _parse_gtfs(path):
+    """
+    Minimal GTFS import: one bus per (route, direction), using the stop pattern of the first
+    trip listed for it in trips.txt. Bus ids are route_id, or route_id-direction_id when a
+    route runs in both directions.
+    """
+    stops = {}
+    for row in _read_csv(os.path.join(path, "stops.txt")):
+        stops[row["stop_id"]] = {"id": row["stop_id"], "name": row["stop_name"],
+                                 "lat": float(row["stop_lat"]), "lon": float(row["stop_lon"])}
+
+    route_info = {}
+    for row in _read_csv(os.path.join(path, "routes.txt")):
+        route_info[row["route_id"]] = (row.get("route_short_name") or row["route_id"],
+                                       row.get("route_long_name") or "")
+
+    pattern_trip = {}  # (route_id, direction_id) -> trip_id
+    for row in _read_csv(os.path.join(path, "trips.txt")):
+        pattern_trip.setdefault((row["route_id"], row.get("direction_id") or "0"), row["trip_id"])
+    wanted = {trip: key for key, trip in pattern_trip.items()}
+
+    stop_seq = {key: [] for key in pattern_trip}
+    for row in _read_csv(os.path.join(path, "stop_times.txt")):
+        key = wanted.get(row["trip_id"])
+        if key is not None:
+            stop_seq[key].append((int(row["stop_sequence"]), row["stop_id"]))
+
+    directions = {}
+    for route_id, direction in pattern_trip:
+        directions.setdefault(route_id, []).append(direction)
+
+    bus_defs = []
+    for (route_id, direction), seq in stop_seq.items():
+        bid = route_id if len(directions[route_id]) == 1 else f"{route_id}-{direction}"
+        short, long_name = route_info.get(route_id, (route_id, ""))
+        info = {"name": short, "route": long_name, "total_seats": DEFAULT_TOTAL_SEATS,
+                "available_seats": DEFAULT_TOTAL_SEATS}
+        bus_defs.append((bid, info, [sid for _, sid in sorted(seq)]))
+    return _build(stops, bus_defs)
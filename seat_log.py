@@ -0,0 +1,166 @@
+# seat_log.py
+import collections, json, os, threading
+
+# ------------------------------
+# SEAT EVENT LOG (append-only, idempotent)
+# ------------------------------
+# One compact JSON line per accepted seat event:
+#   {"id":"cam3-000172","bus":"BusA","b":2,"a":0,"ts":1718000000.5}
+# Event ids already in the log are rejected, so camera retries never double-apply a count,
+# and replaying the file after a restart rebuilds the same seat counts.
+# With path=None nothing is written (ids are still deduplicated in memory).
+# 'size' is the logical byte length of the log; callers use it to remember how much of the log
+# a checkpoint already reflects (see FleetStateFile.write_seats).
+#
+# Compaction: once every bus has been checkpointed at 'size', no logged event needs replaying
+# any more. compact() then rewrites the file with only the most recent events (kept so their
+# ids still deduplicate retries) behind a {"base": B} header line. B is the logical offset of
+# the file's first byte, chosen so logical offsets never move and checkpoints stay valid.
+
+HEADER_BYTES = 32  # fixed-width (space padded) header line, so its length never depends on B
+
+
+def is_valid_event(ev):
+    """True for a dict with str "id"/"bus" and int "b"/"a" (what record() expects and replay() can apply)."""
+    return (isinstance(ev, dict) and isinstance(ev.get("id"), str) and isinstance(ev.get("bus"), str)
+            and type(ev.get("b")) is int and type(ev.get("a")) is int)
+
+
+class SeatEventLog:
+    def __init__(self, path, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        self.seen = set()
+        self._lock = threading.Lock()
+        self._file = None
+        self.base = 0
+        self.size = 0
+
+    @property
+    def file_bytes(self):
+        """Bytes of events on disk since the last compaction started them over."""
+        return self.size - self.base
+
+    def replay(self):
+        """
+        Yield (end_offset, event) for every logged event in file order and remember its id;
+        end_offset is the logical position right after the event's line. A torn last line or a
+        malformed event (see is_valid_event) is skipped.
+        """
+        if not self.path or not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            self.base = _read_base(f)
+            self.size = self.base + f.tell()
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # torn tail of a crashed write, cut off by the next append
+                self.size += len(line)
+                try:
+                    ev = json.loads(line)
+                except ValueError:
+                    continue
+                if not is_valid_event(ev):
+                    continue
+                self.seen.add(ev["id"])
+                yield self.size, ev
+
+    def _open(self):
+        """Open the file for appending, first truncating a torn last line so the next event starts on its own line."""
+        f = open(self.path, "a+b")
+        end = f.seek(0, os.SEEK_END)
+        complete = _complete_length(f, end)
+        if complete < end:
+            f.truncate(complete)
+        f.seek(0)
+        self.base = _read_base(f)
+        self.size = self.base + complete
+        f.seek(0, os.SEEK_END)
+        return f
+
+    def record(self, events):
+        """
+        Append the events whose id has not been seen yet, in one write, and return them.
+        Events are dicts with "id", "bus", "b" (boarded), "a" (alighted) and "ts".
+        """
+        with self._lock:
+            fresh = []
+            for ev in events:
+                if ev["id"] in self.seen:
+                    continue
+                self.seen.add(ev["id"])
+                fresh.append(ev)
+            if fresh and self.path:
+                if self._file is None:
+                    self._file = self._open()
+                data = "".join(json.dumps(ev, separators=(",", ":")) + "\n" for ev in fresh).encode("utf-8")
+                self._file.write(data)
+                self._file.flush()
+                self.size += len(data)
+                if self.fsync:
+                    os.fsync(self._file.fileno())
+            return fresh
+
+    def compact(self, keep_events):
+        """
+        Rewrite the log with only its last keep_events events, kept for deduplication; the caller
+        must have checkpointed every bus at the current size, since nothing logged so far is
+        replayed afterwards. Logical offsets (size) are unchanged. Returns the bytes dropped.
+        """
+        with self._lock:
+            if not self.path or not os.path.exists(self.path):
+                return 0
+            if self._file is None:
+                self._file = self._open()
+            self._file.seek(0)
+            _read_base(self._file)
+            kept = collections.deque(maxlen=keep_events)
+            for line in self._file:
+                try:
+                    ev = json.loads(line)
+                except ValueError:
+                    continue
+                if line.endswith(b"\n") and is_valid_event(ev):
+                    kept.append((ev["id"], line))
+            body = b"".join(line for _, line in kept)
+            old_bytes = self.file_bytes
+            if old_bytes <= len(body) + HEADER_BYTES:
+                return 0
+            base = self.size - len(body) - HEADER_BYTES
+            header = json.dumps({"base": base}).encode("utf-8").ljust(HEADER_BYTES - 1) + b"\n"
+            tmp = self.path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(header + body)
+                f.flush()
+                os.fsync(f.fileno())
+            self._file.close()
+            os.replace(tmp, self.path)
+            self._file = self._open()
+            self.seen = {event_id for event_id, _ in kept}
+            return old_bytes - len(body)
+
+
+def _read_base(f):
+    """Logical offset of the file's first byte, from a {"base": B} header line (0 without one); leaves f after the header."""
+    first = f.readline()
+    try:
+        header = json.loads(first) if first.endswith(b"\n") else None
+    except ValueError:
+        header = None
+    if isinstance(header, dict) and set(header) == {"base"} and type(header["base"]) is int:
+        return header["base"]
+    f.seek(0)
+    return 0
+
+
+def _complete_length(f, end):
+    """Length of the file up to and including its last newline."""
+    pos = end
+    while pos > 0:
+        start = max(0, pos - 4096)
+        f.seek(start)
+        i = f.read(pos - start).rfind(b"\n")
+        if i >= 0:
+            return start + i + 1
+        pos = start
+    return 0
@@ -0,0 +1,94 @@
+# spatial.py
+import math
+import numpy as np
+from fleet_sim import haversine_np
+
+# ------------------------------
+# GRID SPATIAL INDEX
+# ------------------------------
+# Items (stops or buses) are integer indices into position arrays. Each item sits in one cell
+# of a uniform lat/lon grid (cell_m meters tall), so a radius query only looks at the few cells
+# overlapping the search box and runs one vectorized haversine over those candidates.
+#
+# Cell lists are copy-on-write: moving an item builds new lists for the two cells involved, so
+# request threads can query while the simulator moves buses, without locks.
+
+M_PER_DEG_LAT = 6371.0 * 1000.0 * math.pi / 180.0
+
+
+class GridIndex:
+    def __init__(self, lat, lon, cell_m=250.0, ref_lat=None):
+        self.cell_m = cell_m
+        lat = np.asarray(lat, dtype=np.float64)
+        if ref_lat is None:
+            ref_lat = float(lat.mean()) if lat.size else 0.0
+        self.dlat = cell_m / M_PER_DEG_LAT
+        self.dlon = self.dlat / max(0.01, math.cos(math.radians(ref_lat)))
+        self.cells = {}
+        self.lat = lat
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.cell_lat, self.cell_lon = self._cells_of(self.lat, self.lon)
+        for i, key in enumerate(zip(self.cell_lat.tolist(), self.cell_lon.tolist())):
+            self.cells.setdefault(key, []).append(i)
+
+    def _cells_of(self, lat, lon):
+        return (np.floor(lat / self.dlat).astype(np.int64),
+                np.floor(lon / self.dlon).astype(np.int64))
+
+    def update(self, lat, lon):
+        """New positions for every item (arrays in item order); only items that changed cell are re-filed."""
+        cell_lat, cell_lon = self._cells_of(lat, lon)
+        moved = np.nonzero((cell_lat != self.cell_lat) | (cell_lon != self.cell_lon))[0]
+        for i in moved.tolist():
+            old = (int(self.cell_lat[i]), int(self.cell_lon[i]))
+            new = (int(cell_lat[i]), int(cell_lon[i]))
+            remaining = [j for j in self.cells.get(old, ()) if j != i]
+            if remaining:
+                self.cells[old] = remaining
+            else:
+                self.cells.pop(old, None)
+            self.cells[new] = self.cells.get(new, []) + [i]
+        self.cell_lat, self.cell_lon = cell_lat, cell_lon
+        self.lat, self.lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+
+    def query_radius(self, lat, lon, radius_m, limit=None):
+        """(indices, distances in meters) of the items within radius_m of (lat, lon), nearest first."""
+        r_lat = radius_m / M_PER_DEG_LAT
+        r_lon = r_lat / max(0.01, math.cos(math.radians(lat)))
+        lat0, lat1 = math.floor((lat - r_lat) / self.dlat), math.floor((lat + r_lat) / self.dlat)
+        lon0, lon1 = math.floor((lon - r_lon) / self.dlon), math.floor((lon + r_lon) / self.dlon)
+
+        candidates = []
+        cells = self.cells
+        if (lat1 - lat0 + 1) * (lon1 - lon0 + 1) > len(cells):
+            # Huge radius: walking the occupied cells is cheaper than walking the box
+            for (cy, cx), items in list(cells.items()):
+                if lat0 <= cy <= lat1 and lon0 <= cx <= lon1:
+                    candidates.extend(items)
+        else:
+            for cy in range(lat0, lat1 + 1):
+                for cx in range(lon0, lon1 + 1):
+                    items = cells.get((cy, cx))
+                    if items:
+                        candidates.extend(items)
+        if not candidates:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        idx = np.array(candidates, dtype=np.int64)
+        pos_lat, pos_lon = self.lat, self.lon  # one consistent set of positions
+        dist = haversine_np(lat, lon, pos_lat[idx], pos_lon[idx])
+        keep = dist <= radius_m
+        idx, dist = idx[keep], dist[keep]
+        order = np.argsort(dist, kind="stable")
+        if limit is not None:
+            order = order[:limit]
+        return idx[order], dist[order]
+
+    def nearest(self, lat, lon, k=1, max_radius_m=20000.0):
+        """The k nearest items within max_radius_m, searching outward in growing rings."""
+        radius = self.cell_m
+        while True:
+            idx, dist = self.query_radius(lat, lon, radius, limit=k)
+            if len(idx) >= k or radius >= max_radius_m:
+                return idx, dist
+            radius = min(radius * 4, max_radius_m)
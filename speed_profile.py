@@ -0,0 +1,194 @@
+# speed_profile.py
+import os, threading, time
+import numpy as np
+
+# ------------------------------
+# LEARNED SEGMENT TRAVEL TIMES (per segment, per time of day)
+# ------------------------------
+# A segment is a (from stop id, to stop id) pair, so routes driving the same pair of stops learn
+# together. For every segment and every bucket_sec slice of the day, sec[seg, bucket] is an
+# exponentially weighted moving average of the observed travel times (stop passed -> next stop
+# passed, dwell included); sec_all[seg] is the same average over the whole day and stands in for
+# buckets that have no observations yet. Before any observation a segment takes length / default speed,
+# which is exactly the old constant-speed ETA.
+#
+# ETA readers use table(): per-bus flat arrays in fleet order (bus i at route_offset[i] + stop index)
+# of the current bucket's segment seconds and their prefix sums, rebuilt at most once per change
+# and swapped in whole, so a route's ETAs stay one linear pass of O(1) lookups.
+#
+# save()/load() keep the averages in a .npz keyed by stop id pairs, so they survive restarts and
+# network edits (segments that no longer exist are dropped, new ones start from the prior).
+
+
+class SegmentSpeedProfiles:
+    def __init__(self, routes, seg_m, default_speed_ms, bucket_sec=1800, alpha=0.2, utc_offset=None):
+        """
+        routes: bus_id -> stops (route order), seg_m: bus_id -> segment lengths (segment k runs from
+        stop k to stop k+1, the last one closes the loop). utc_offset (seconds) places the day
+        buckets in local time (default: this machine's timezone).
+        """
+        self.bus_ids = list(routes.keys())
+        self.offset = {}  # bus_id -> position of its stop 0 in the flat arrays
+        self.bucket_sec = int(bucket_sec)
+        self.n_buckets = max(1, 86400 // self.bucket_sec)
+        self.alpha = alpha
+        self.utc_offset = time.localtime().tm_gmtoff if utc_offset is None else utc_offset
+
+        pair_ids, pair_m, seg, offsets, lengths = {}, [], [], [], []
+        for bid in self.bus_ids:
+            route = routes[bid]
+            self.offset[bid] = len(seg)
+            offsets.append(len(seg))
+            lengths.append(len(route))
+            for k, length in enumerate(seg_m[bid]):
+                key = (route[k]["id"], route[(k + 1) % len(route)]["id"])
+                if key not in pair_ids:
+                    pair_ids[key] = len(pair_m)
+                    pair_m.append(length)
+                seg.append(pair_ids[key])
+        self.route_offset = np.array(offsets, dtype=np.int64)
+        self.route_len = np.array(lengths, dtype=np.int64)
+        self.pair_keys = list(pair_ids)
+        self.seg = np.array(seg, dtype=np.int64)          # flat (fleet order) -> segment id
+
+        n = len(pair_m)
+        self.prior = np.array(pair_m, dtype=np.float64) / default_speed_ms
+        self.sec = np.zeros((n, self.n_buckets), dtype=np.float32)
+        self.count = np.zeros((n, self.n_buckets), dtype=np.uint32)
+        self.sec_all = np.zeros(n, dtype=np.float32)
+        self.count_all = np.zeros(n, dtype=np.uint32)
+
+        # Last stop each bus was reported past (-1: unknown) and when it passed it (NaN: not seen passing)
+        self.pass_idx = np.full(len(self.bus_ids), -1, dtype=np.int64)
+        self.pass_ts = np.full(len(self.bus_ids), np.nan)
+
+        self._lock = threading.Lock()
+        self._dirty = True
+        self._table = None
+
+    def bucket_of(self, ts):
+        """Time-of-day bucket of unix time(s) ts."""
+        day_sec = np.floor(np.asarray(ts, dtype=np.float64) + self.utc_offset).astype(np.int64) % 86400
+        return day_sec // self.bucket_sec % self.n_buckets
+
+    # ---------------------------
+    # Learning
+    # ---------------------------
+    def record_passes(self, rows, last_idx, ts):
+        """
+        Report the last passed stop of the given bus rows (fleet order) at time(s) ts. Rows may
+        repeat (several GPS fixes of one bus, oldest first): every stop change is taken at its own ts.
+        A bus seen passing stop k and then stop k+1 yields one travel time observation for segment k;
+        first reports and bigger jumps (sparse GPS) only tell where the bus is. Returns the number
+        of observations.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        order = np.argsort(rows, kind="stable")  # each bus's reports together, still oldest first
+        rows = rows[order]
+        last_idx = np.broadcast_to(np.asarray(last_idx, dtype=np.int64), order.shape)[order]
+        ts = np.broadcast_to(np.asarray(ts, dtype=np.float64), order.shape)[order]
+        # A report follows the bus's previous report in this call, or else its stored state
+        same = np.r_[False, rows[1:] == rows[:-1]]
+        prev = np.where(same, np.r_[0, last_idx[:-1]], self.pass_idx[rows])
+        changed = prev != last_idx
+        if not changed.any():
+            return 0
+        rows, last_idx, prev, ts = rows[changed], last_idx[changed], prev[changed], ts[changed]
+        same = np.r_[False, rows[1:] == rows[:-1]]
+        one_step = (prev >= 0) & (last_idx == (prev + 1) % self.route_len[rows])
+        passed_ts = np.where(one_step, ts, np.nan)
+        start = np.where(same, np.r_[np.nan, passed_ts[:-1]], self.pass_ts[rows])
+        timed = one_step & ~np.isnan(start)
+        if timed.any():
+            t = np.nonzero(timed)[0]
+            t = t[np.argsort(ts[t], kind="stable")]  # fold in time order, as separate calls would
+            self.observe(self.route_offset[rows[t]] + prev[t], start[t], ts[t] - start[t])
+        newest = np.r_[rows[1:] != rows[:-1], True]
+        self.pass_idx[rows[newest]] = last_idx[newest]
+        self.pass_ts[rows[newest]] = passed_ts[newest]
+        return int(timed.sum())
+
+    def forget(self, rows):
+        """Forget where the given bus rows are (they moved without being observed, e.g. simulated)."""
+        self.pass_idx[np.asarray(rows, dtype=np.int64)] = -1
+
+    def observe(self, flat, start_ts, elapsed):
+        """Fold travel times 'elapsed' (seconds) of flat segments 'flat', started at start_ts, into the averages."""
+        seg = self.seg[np.asarray(flat, dtype=np.int64)]
+        if seg.size == 0:
+            return
+        bucket = np.broadcast_to(self.bucket_of(start_ts), seg.shape)
+        elapsed = np.broadcast_to(np.asarray(elapsed, dtype=np.float64), seg.shape)
+        # Several buses finishing the same segment at once are folded in one after the other
+        while seg.size:
+            _, first = np.unique(seg, return_index=True)
+            self._fold(seg[first], bucket[first], elapsed[first])
+            rest = np.ones(seg.size, dtype=bool)
+            rest[first] = False
+            seg, bucket, elapsed = seg[rest], bucket[rest], elapsed[rest]
+        self._dirty = True
+
+    def _fold(self, s, b, dt):
+        """One EWMA step for distinct segments s (buckets b); a first observation replaces the prior."""
+        seen, seen_all = self.count[s, b] > 0, self.count_all[s] > 0
+        sec, sec_all = self.sec[s, b].astype(np.float64), self.sec_all[s].astype(np.float64)
+        expected = np.where(seen, sec, np.where(seen_all, sec_all, self.prior[s]))
+        dt = np.clip(dt, expected / 4.0, expected * 4.0)  # one stuck or teleported bus can't wreck a profile
+        self.sec[s, b] = np.where(seen, sec + self.alpha * (dt - sec), dt)
+        self.sec_all[s] = np.where(seen_all, sec_all + self.alpha * (dt - sec_all), dt)
+        self.count[s, b] += 1
+        self.count_all[s] += 1
+
+    # ---------------------------
+    # ETA tables
+    # ---------------------------
+    def table(self, now=None):
+        """
+        {"bucket", "seg_s", "cum_s", "loop_s"} for the time-of-day bucket of 'now': seg_s / cum_s are
+        flat lists in fleet order (segment seconds, and seconds from stop 0 to each stop), loop_s the
+        seconds of each bus's full loop.
+        """
+        bucket = int(self.bucket_of(time.time() if now is None else now))
+        t = self._table
+        if t is not None and t["bucket"] == bucket and not self._dirty:
+            return t
+        with self._lock:
+            t = self._table
+            if t is not None and t["bucket"] == bucket and not self._dirty:
+                return t
+            self._dirty = False
+            base = np.where(self.count_all > 0, self.sec_all, self.prior)
+            per_seg = np.where(self.count[:, bucket] > 0, self.sec[:, bucket], base).astype(np.float64)
+            seg_s = per_seg[self.seg]
+            # Exclusive prefix sums restarted at every route's first stop
+            cum = np.cumsum(seg_s) - seg_s
+            cum -= np.repeat(cum[self.route_offset], self.route_len)
+            loop_s = cum[self.route_offset + self.route_len - 1] + seg_s[self.route_offset + self.route_len - 1]
+            t = {"bucket": bucket, "seg_s": seg_s.tolist(), "cum_s": cum.tolist(), "loop_s": loop_s.tolist()}
+            self._table = t
+            return t
+
+    # ---------------------------
+    # Persistence
+    # ---------------------------
+    def save(self, path):
+        """Write the averages to 'path' (.npz, replaced atomically)."""
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, bucket_sec=self.bucket_sec,
+                 from_id=np.array([a for a, _ in self.pair_keys]), to_id=np.array([b for _, b in self.pair_keys]),
+                 sec=self.sec, count=self.count, sec_all=self.sec_all, count_all=self.count_all)
+        os.replace(tmp, path)
+
+    def load(self, path):
+        """Load averages written by save() for the segments that still exist; returns how many matched."""
+        with np.load(path) as f:
+            saved = {key: i for i, key in enumerate(zip(f["from_id"].tolist(), f["to_id"].tolist()))}
+            dst = [s for s, key in enumerate(self.pair_keys) if key in saved]
+            src = [saved[self.pair_keys[s]] for s in dst]
+            if int(f["bucket_sec"]) == self.bucket_sec:
+                self.sec[dst], self.count[dst] = f["sec"][src], f["count"][src]
+            else:
+                self.sec[dst], self.count[dst] = 0, 0  # other day slicing: keep only the all-day averages
+            self.sec_all[dst], self.count_all[dst] = f["sec_all"][src], f["count_all"][src]
+        self._dirty = True
+        return len(dst)
@@ -0,0 +1,157 @@
+# state_file.py
+import os, struct, threading, time
+import numpy as np
+
+# ------------------------------
+# MEMORY-MAPPED FLEET STATE
+# ------------------------------
+# Fixed binary layout, so a checkpoint is a handful of array copies into mapped memory
+# (the kernel writes the pages back in the background) and a restart or another process
+# can read it back without parsing anything:
+#
+#   header   64 bytes   magic "SBUS", layout version, bus count, seqlock counter, tick
+#   bus ids  32 bytes per bus (UTF-8, NUL padded), in fleet order
+#   records  RECORD_DTYPE per bus, in the same order
+#
+# Every write is bracketed by the seqlock counter (odd while a write is in progress);
+# readers copy the records and retry if the counter moved, so they never see a torn tick.
+
+MAGIC = b"SBUS"
+LAYOUT_VERSION = 1
+HEADER = struct.Struct("<4sII")  # magic, layout version, bus count (seq + tick follow as u64 views)
+HEADER_SIZE = 64
+SEQ_OFFSET = 16
+TICK_OFFSET = 24
+ID_SIZE = 32
+
+RECORD_DTYPE = np.dtype([
+    ("lat", "<f8"),
+    ("lon", "<f8"),
+    ("last_idx", "<i4"),
+    ("available_seats", "<i4"),
+    ("seat_log_offset", "<i8"),  # seat event log size when available_seats was written
+])
+
+
+def _layout_size(n):
+    return HEADER_SIZE + ID_SIZE * n + RECORD_DTYPE.itemsize * n
+
+
+class FleetStateFile:
+    """
+    Writer/reader for the memory-mapped fleet state. FleetStateFile(path, bus_ids) opens the file
+    for writing (re-creating it when the fleet changed; the previous records stay available in
+    .saved / .saved_tick), FleetStateFile.open_reader(path) maps an existing file read-only for other processes.
+    """
+
+    def __init__(self, path, bus_ids=None, readonly=False):
+        self.path = path
+        self._write_lock = threading.Lock()
+        self.saved = {}
+        self.saved_tick = 0
+
+        existing = self._read_ids(path)
+        if readonly:
+            if existing is None:
+                raise FileNotFoundError(f"No fleet state file at {path}")
+            self.bus_ids = existing
+            self._map("r")
+            return
+
+        self.bus_ids = list(bus_ids)
+        if existing is not None:
+            old = FleetStateFile(path, readonly=True)
+            self.saved_tick, records = old.snapshot()
+            self.saved = {bid: rec for bid, rec in zip(old.bus_ids, records)}
+            old.close()
+        if existing != self.bus_ids:
+            self._create()
+        self._map("r+")
+
+    @classmethod
+    def open_reader(cls, path):
+        return cls(path, readonly=True)
+
+    # ---------------------------
+    # Layout
+    # ---------------------------
+    @staticmethod
+    def _read_ids(path):
+        """Bus ids stored in an existing, valid state file (None when missing or incompatible)."""
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            head = f.read(HEADER_SIZE)
+            if len(head) < HEADER_SIZE:
+                return None
+            magic, version, n = HEADER.unpack_from(head)
+            if magic != MAGIC or version != LAYOUT_VERSION or os.path.getsize(path) != _layout_size(n):
+                return None
+            raw = f.read(ID_SIZE * n)
+        return [raw[i * ID_SIZE:(i + 1) * ID_SIZE].rstrip(b"\0").decode("utf-8") for i in range(n)]
+
+    def _create(self):
+        n = len(self.bus_ids)
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(HEADER.pack(MAGIC, LAYOUT_VERSION, n).ljust(HEADER_SIZE, b"\0"))
+            for bid in self.bus_ids:
+                raw = bid.encode("utf-8")
+                if len(raw) > ID_SIZE:
+                    raise ValueError(f"Bus id too long for the state file: {bid!r}")
+                f.write(raw.ljust(ID_SIZE, b"\0"))
+            f.write(b"\0" * (RECORD_DTYPE.itemsize * n))
+        os.replace(tmp, self.path)
+
+    def _map(self, mode):
+        n = len(self.bus_ids)
+        self._mm = np.memmap(self.path, dtype=np.uint8, mode=mode, shape=(_layout_size(n),))
+        self._seq = np.ndarray((1,), dtype="<u8", buffer=self._mm, offset=SEQ_OFFSET)
+        self._tick = np.ndarray((1,), dtype="<u8", buffer=self._mm, offset=TICK_OFFSET)
+        self.records = np.ndarray((n,), dtype=RECORD_DTYPE, buffer=self._mm, offset=HEADER_SIZE + ID_SIZE * n)
+        self.index = {bid: i for i, bid in enumerate(self.bus_ids)}
+
+    def close(self):
+        self.records = self._seq = self._tick = None
+        self._mm = None
+
+    # ---------------------------
+    # Writes (seqlock-bracketed)
+    # ---------------------------
+    def write_positions(self, lat, lon, last_idx, tick):
+        """Checkpoint every bus position (arrays in bus_ids order) for simulator tick 'tick'."""
+        with self._write_lock:
+            self._seq[0] += 1
+            self.records["lat"] = lat
+            self.records["lon"] = lon
+            self.records["last_idx"] = last_idx
+            self._tick[0] = tick
+            self._seq[0] += 1
+
+    def write_seats(self, bid, available_seats, seat_log_offset):
+        """Checkpoint one bus's seat count together with the seat log size it reflects."""
+        i = self.index[bid]
+        with self._write_lock:
+            self._seq[0] += 1
+            self.records["available_seats"][i] = available_seats
+            self.records["seat_log_offset"][i] = seat_log_offset
+            self._seq[0] += 1
+
+    # ---------------------------
+    # Reads
+    # ---------------------------
+    def snapshot(self):
+        """Consistent (tick, records copy) — retries while a writer is in the middle of an update."""
+        while True:
+            before = int(self._seq[0])
+            if before % 2 == 0:
+                tick = int(self._tick[0])
+                records = self.records.copy()
+                if int(self._seq[0]) == before:
+                    return tick, records
+            time.sleep(0)
+
+    @property
+    def seq(self):
+        """Seqlock counter; changes whenever anything was written."""
+        return int(self._seq[0])